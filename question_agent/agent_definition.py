@@ -2,31 +2,73 @@
 OpenAI Agent for Question Generation
 """
 
+import os
 import time
+import asyncio
+import logging
+import weakref
+import httpx
 from typing import List, Dict, Any
 from dotenv import load_dotenv
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, InternalServerError
+from tenacity import retry, stop_after_attempt, wait_random_exponential, retry_if_exception_type
 from schemas import QuestionBatch
 from prompts import SYSTEM_PROMPT, make_user_prompt_for_section
-from agents import Agent,Runner, RunConfig, ModelSettings, output_guardrail, GuardrailFunctionOutput, RunContextWrapper
+from rate_limiter import get_limiter, estimate_tokens
+from response_cache import cache_enabled, make_cache_key, get_cached, set_cached
+from agents import Agent,Runner, RunConfig, ModelSettings, output_guardrail, GuardrailFunctionOutput, RunContextWrapper, set_default_openai_client
 
 # Load environment
 load_dotenv()
 
+MODEL_NAME = "gpt-4o-2024-08-06"
+TEMPERATURE = 0.7
+OUTPUT_TOKENS_PER_QUESTION = 300  # rough budget used to reserve rate-limit tokens
+MAX_ATTEMPTS = 4  # attempts per agent call on transient API errors
+MAX_CONCURRENT_CALLS = int(os.getenv("OPENAI_MAX_CONCURRENCY", 16))  # agent calls in flight, across all exams
+
+logger = logging.getLogger("batch")
+
+# Call slots per event loop. httpx connections and asyncio primitives are bound to the loop
+# that first uses them, so each asyncio.run (batch runs, tests, notebooks) gets its own.
+_loop_call_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def _call_slots() -> asyncio.Semaphore:
+    """
+    Cap on agent calls in flight for the running event loop
+    
+    The first call on a new loop also gives the Agents SDK a fresh client: one keep-alive
+    connection pool for every agent call of that run instead of a TLS handshake per call.
+    """
+    loop = asyncio.get_running_loop()
+    slots = _loop_call_slots.get(loop)
+    if slots is None:
+        set_default_openai_client(AsyncOpenAI(
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+            )
+        ))
+        slots = _loop_call_slots[loop] = asyncio.Semaphore(MAX_CONCURRENT_CALLS)
+    return slots
+
 @output_guardrail
 async def structure_output_guardrail(ctx: RunContextWrapper[None], agent: Agent, output: QuestionBatch):
-    try:
-        # Force validation by re-parsing into QuestionBatch
-        _ = QuestionBatch.model_validate(output)
-
+    # output_type=QuestionBatch already parsed and validated the output, so only sniff the structure
+    if not isinstance(output, QuestionBatch):
         return GuardrailFunctionOutput(
-            output_info={"ok": True, "message": "Valid QuestionBatch structure"},
-            tripwire_triggered=False
+            output_info={"error": f"Invalid structure: expected QuestionBatch, got {type(output).__name__}"},
+            tripwire_triggered=True
         )
-    except Exception as e:
+    if not output.questions:
         return GuardrailFunctionOutput(
-            output_info={"error": f"Invalid structure: {str(e)}"},
+            output_info={"error": "Invalid structure: no valid questions in batch"},
             tripwire_triggered=True
         )
+
+    return GuardrailFunctionOutput(
+        output_info={"ok": True, "message": "Valid QuestionBatch structure"},
+        tripwire_triggered=False
+    )
     
 # @output_guardrail
 # async def batch_output_guardrail(ctx: RunContextWrapper[None], agent: Agent, output: QuestionBatch):
@@ -50,11 +92,46 @@ question_agent = Agent(
     # output_guardrails=[structure_output_guardrail,batch_output_guardrail],
 )
 
+_jittered_backoff = wait_random_exponential(multiplier=1, max=30)
+
+def _wait_for_retry(retry_state) -> float:
+    """Honor the server's Retry-After on 429s, otherwise back off exponentially with jitter"""
+    response = getattr(retry_state.outcome.exception(), "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), 60.0)
+        except ValueError:
+            pass  # HTTP-date form; fall back to our own backoff
+    return _jittered_backoff(retry_state)
+
+@retry(
+    stop=stop_after_attempt(MAX_ATTEMPTS),
+    wait=_wait_for_retry,
+    retry=retry_if_exception_type((RateLimitError, APIConnectionError, InternalServerError)),  # APITimeoutError is an APIConnectionError
+    reraise=True
+)
+async def _run_agent(user_prompt: str, estimated_tokens: int):
+    """Run the agent once; transient rate-limit/connection/5xx errors back off with jitter and retry"""
+    limiter = get_limiter("openai", MODEL_NAME)
+    # Reserve quota first so parallel sections don't trip 429s
+    async with limiter.reserve(estimated_tokens):
+        response = await Runner.run(
+            starting_agent=question_agent,
+            input=user_prompt,
+            run_config=RunConfig(
+                model=MODEL_NAME,
+                model_settings=ModelSettings(temperature=TEMPERATURE)
+            ),
+        )
+    limiter.refund(estimated_tokens - response.context_wrapper.usage.total_tokens)
+    return response
+
 async def generate_questions_with_agent(section_info: Dict[str, Any], topics: List[Dict[str, Any]], exam: str, grade: int, level: int) -> Dict[str, Any]:
     """Agent call - just run and return!"""
 
     if not topics:
-        print(f"WARNING: No topics found for section {section_info['section_name']}")
+        logger.warning(f"No topics found for section {section_info['section_name']}")
         return {"questions": []}
 
     # Create user prompt
@@ -66,33 +143,33 @@ async def generate_questions_with_agent(section_info: Dict[str, Any], topics: Li
         level=level
     )
 
-    started = time.time()
-    # print("started",started)
-    try:
-        # Run agent
-        response = await Runner.run(
-            starting_agent=question_agent,
-            input=user_prompt,
-            run_config=RunConfig(
-                model="gpt-4o-2024-08-06",
-                model_settings=ModelSettings(temperature=0.7)
-            ),
-        )
+    # Identical inputs (retries, re-runs) can skip the LLM entirely
+    use_cache = cache_enabled()
+    if use_cache:
+        cache_key = make_cache_key(SYSTEM_PROMPT, user_prompt, MODEL_NAME, TEMPERATURE)
+        cached = await asyncio.to_thread(get_cached, cache_key)
+        if cached is not None:
+            logger.info(f"CACHE HIT: Reusing {len(cached.get('questions', []))} questions for {section_info['section_name']}")
+            return cached
 
-        q = response.final_output
-        # print("response",response)
-        # print("q",q)
+    estimated_tokens = estimate_tokens(SYSTEM_PROMPT + user_prompt) + OUTPUT_TOKENS_PER_QUESTION * len(topics)
 
-        finished = time.time()
+    started = time.perf_counter()
+    try:
+        # Run agent (bounded, so a wide section/exam fan-out doesn't turn into a 429 storm)
+        async with _call_slots():
+            response = await _run_agent(user_prompt, estimated_tokens)
 
-        # print("finished",finished)
-        # print(f"Time taken for completion ({section_info["section_name"]}) - ",finished-started)
+        q = response.final_output
+        logger.debug("Time taken for completion (%s) - %.2fs", section_info["section_name"], time.perf_counter() - started)
 
         payload = q.model_dump()
+        if use_cache and payload.get("questions"):
+            await asyncio.to_thread(set_cached, cache_key, payload)
 
-        print(f"SUCCESS: Generated {len(payload.get('questions', []))} questions for {section_info['section_name']}")
+        logger.info(f"SUCCESS: Generated {len(payload.get('questions', []))} questions for {section_info['section_name']}")
         return payload
 
     except Exception as e:
-        print(f"ERROR: Failed to generate questions for {section_info['section_name']}: {e}")
+        logger.error(f"Failed to generate questions for {section_info['section_name']}: {e}")
         return {"questions": []}
\ No newline at end of file
@@ -4,22 +4,22 @@ Configuration for Batch Pipeline Processing
 This file contains configuration options for the batch pipeline processing.
 """
 
-from typing import Optional, List
+from typing import Optional, Tuple
 from dataclasses import dataclass
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class BatchConfig:
-    """Configuration for batch processing"""
+    """Configuration for batch processing (immutable, so it is hashable and safe to share)"""
     
     # Processing options
     skip_existing: bool = False  # Skip exams that already have questions
     max_exams: Optional[int] = None  # Limit number of exams to process (None = all)
-    delay_between_exams: float = 1.0  # Delay in seconds between exam processing
+    delay_between_exams: float = 1.0  # Base retry backoff in seconds for a failed exam (doubles per attempt, capped at 30s)
     
     # Filtering options
-    exam_filter: Optional[List[str]] = None  # Only process specific exams (e.g., ["IMO", "IEO"])
-    grade_filter: Optional[List[int]] = None  # Only process specific grades (e.g., [6, 7, 8])
-    level_filter: Optional[List[int]] = None  # Only process specific levels (e.g., [1, 2])
+    exam_filter: Optional[Tuple[str, ...]] = None  # Only process specific exams (e.g., ("IMO", "IEO"))
+    grade_filter: Optional[Tuple[int, ...]] = None  # Only process specific grades (e.g., (6, 7, 8))
+    level_filter: Optional[Tuple[int, ...]] = None  # Only process specific levels (e.g., (1, 2))
     
     # Error handling
     max_retries: int = 3  # Maximum retries for failed exams
@@ -30,9 +30,23 @@ class BatchConfig:
     log_to_file: bool = False  # Log to file instead of console
     log_file_path: str = "batch_pipeline.log"
     
+    # Resume
+    checkpoint_path: Optional[str] = ".batch_checkpoint.json"  # Exams finished by an interrupted run (None = disabled)
+    
+    # Results
+    results_path: Optional[str] = "batch_results.jsonl"  # Per-exam results, one JSON object per line (None = keep in memory)
+    return_full_results: bool = False  # Return every per-exam result instead of only the summary counters
+    
     # Performance
-    batch_size: int = 1  # Process exams in batches (currently sequential)
-    parallel_processing: bool = False  # Enable parallel processing (experimental)
+    max_concurrency: int = 8  # Maximum number of exams processed at the same time
+    max_exams_per_minute: Optional[float] = None  # Global cap on exam starts (None = unlimited)
+
+    def __post_init__(self):
+        # Accept lists from callers/CLI but store tuples so the config stays immutable
+        for name in ("exam_filter", "grade_filter", "level_filter"):
+            value = getattr(self, name)
+            if value is not None and not isinstance(value, tuple):
+                object.__setattr__(self, name, tuple(value))
 
 # Default configuration
 DEFAULT_CONFIG = BatchConfig()
@@ -53,13 +67,13 @@ PRODUCTION_CONFIG = BatchConfig(
 )
 
 IMO_ONLY_CONFIG = BatchConfig(
-    exam_filter=["IMO"],
+    exam_filter=("IMO",),
     skip_existing=False,
     verbose=True
 )
 
 GRADE_6_ONLY_CONFIG = BatchConfig(
-    grade_filter=[12],
+    grade_filter=(12,),
     skip_existing=False,
     verbose=True
 )
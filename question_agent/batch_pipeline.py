@@ -6,7 +6,7 @@ Automatically processes ALL exam overviews from the database and runs the questi
 
 🔹 Features:
 - Fetches all exam overviews from database
-- Processes each exam overview sequentially
+- Processes exam overviews concurrently (bounded by parallel_workers)
 - Progress tracking and logging
 - Error recovery and resume capability
 - Summary reporting
@@ -15,32 +15,56 @@ Automatically processes ALL exam overviews from the database and runs the questi
 import os
 import asyncio
 import time
+import logging
 from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
-from simple_pipeline import run_pipeline
+from simple_pipeline import run_pipeline, configure_engine, dispose_engine
+from logging_config import setup_queue_logging
 
 # Load environment
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Database setup
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine)
+# Database setup (pre-ping + recycle so long batches survive dropped/stale connections).
+# Only the overview and count SELECTs run here, one at a time on the event loop thread; questions
+# are inserted through simple_pipeline's engine, so a small pool is enough.
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=2,
+    max_overflow=0,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    pool_use_lifo=True
+)
+SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
 
-def get_all_exam_overviews() -> List[Dict[str, Any]]:
-    """Fetch all exam overviews from database"""
-    print("Fetching all exam overviews from database...")
+# Single shared logger; records are enqueued and written by a background listener
+logger = logging.getLogger("batch")
+
+# Skip/limit in SQL so only the exams we will actually process come back
+EXAM_OVERVIEWS_QUERY = text("""
+    SELECT eo.exam_overview_id, eo.exam, eo.grade, eo.level, eo.total_questions, eo.total_marks, eo.total_time_mins
+    FROM exam_overview eo
+    WHERE NOT :only_missing OR NOT EXISTS (
+        SELECT 1
+        FROM syllabus s
+        JOIN questions q ON q.syllabus_id = s.syllabus_id
+        WHERE s.exam_overview_id = eo.exam_overview_id
+    )
+    ORDER BY eo.exam, eo.grade, eo.level
+    LIMIT :max_exams
+""")
+
+def get_all_exam_overviews(max_exams: Optional[int] = None, only_missing: bool = False) -> List[Dict[str, Any]]:
+    """Fetch exam overviews from database (optionally only those without questions, capped at max_exams)"""
+    logger.info("Fetching all exam overviews from database...")
     
     with SessionLocal() as session:
-        query = text("""
-            SELECT exam_overview_id, exam, grade, level, total_questions, total_marks, total_time_mins
-            FROM exam_overview
-            ORDER BY exam, grade, level
-        """)
-        result = session.execute(query)
+        # LIMIT NULL means no limit in PostgreSQL
+        result = session.execute(EXAM_OVERVIEWS_QUERY, {"only_missing": only_missing, "max_exams": max_exams or None})
         exam_overviews = []
         
         for row in result:
@@ -54,50 +78,48 @@ def get_all_exam_overviews() -> List[Dict[str, Any]]:
                 "total_time_mins": row.total_time_mins
             })
     
-    print(f"Found {len(exam_overviews)} exam overviews to process:")
+    logger.info(f"Found {len(exam_overviews)} exam overviews to process:")
     for exam in exam_overviews:
-        print(f"  - {exam['exam']} Grade {exam['grade']} Level {exam['level']} ({exam['total_questions']} questions)")
+        logger.info(f"  - {exam['exam']} Grade {exam['grade']} Level {exam['level']} ({exam['total_questions']} questions)")
     
     return exam_overviews
 
-def check_exam_has_questions(exam_overview_id: int) -> bool:
-    """Check if exam already has questions generated"""
+QUESTION_COUNTS_QUERY = text("""
+    SELECT s.exam_overview_id, COUNT(*) AS question_count
+    FROM questions q
+    JOIN syllabus s ON q.syllabus_id = s.syllabus_id
+    WHERE s.exam_overview_id = ANY(:exam_ids)
+    GROUP BY s.exam_overview_id
+""")
+
+def get_question_counts_for_exams(exam_ids: List[int]) -> Dict[int, int]:
+    """Get current question counts for many exams in one query (exams without questions are omitted)"""
+    if not exam_ids:
+        return {}
     with SessionLocal() as session:
-        query = text("""
-            SELECT COUNT(*) as question_count
-            FROM questions q
-            JOIN syllabus s ON q.syllabus_id = s.syllabus_id
-            WHERE s.exam_overview_id = :exam_id
-        """)
-        result = session.execute(query, {"exam_id": exam_overview_id})
-        count = result.scalar()
-        return count > 0
+        result = session.execute(QUESTION_COUNTS_QUERY, {"exam_ids": list(exam_ids)})
+        return {row.exam_overview_id: row.question_count for row in result}
 
 def get_exam_question_count(exam_overview_id: int) -> int:
     """Get current question count for an exam"""
-    with SessionLocal() as session:
-        query = text("""
-            SELECT COUNT(*) as question_count
-            FROM questions q
-            JOIN syllabus s ON q.syllabus_id = s.syllabus_id
-            WHERE s.exam_overview_id = :exam_id
-        """)
-        result = session.execute(query, {"exam_id": exam_overview_id})
-        return result.scalar()
+    return get_question_counts_for_exams([exam_overview_id]).get(exam_overview_id, 0)
 
 def log_batch_progress(current: int, total: int, exam_info: Dict[str, Any], status: str, details: str = ""):
     """Log progress for batch processing"""
     progress_percent = (current / total) * 100
-    print(f"\n{'='*80}")
-    print(f"BATCH PROGRESS: {current}/{total} ({progress_percent:.1f}%)")
-    print(f"Current Exam: {exam_info['exam']} Grade {exam_info['grade']} Level {exam_info['level']}")
-    print(f"Status: {status}")
+    # One record per update instead of a multi-line banner
+    message = (f"BATCH PROGRESS: {current}/{total} ({progress_percent:.1f}%) | "
+               f"{exam_info['exam']} Grade {exam_info['grade']} Level {exam_info['level']} | {status}")
     if details:
-        print(f"Details: {details}")
-    print(f"{'='*80}\n")
+        message += f" | {details}"
+    if status == "FAILED":
+        logger.error(message)
+    else:
+        logger.info(message)
 
-async def process_single_exam(exam_info: Dict[str, Any], current: int, total: int) -> Dict[str, Any]:
-    """Process a single exam overview"""
+async def process_single_exam(exam_info: Dict[str, Any], current: int, total: int,
+                              question_counts: Optional[Dict[int, int]] = None) -> Dict[str, Any]:
+    """Process a single exam overview (question_counts: prefetched counts from get_question_counts_for_exams)"""
     exam_overview_id = exam_info["exam_overview_id"]
     exam = exam_info["exam"]
     grade = exam_info["grade"]
@@ -106,7 +128,10 @@ async def process_single_exam(exam_info: Dict[str, Any], current: int, total: in
     log_batch_progress(current, total, exam_info, "STARTING")
     
     # Check if exam already has questions
-    existing_count = get_exam_question_count(exam_overview_id)
+    if question_counts is not None:
+        existing_count = question_counts.get(exam_overview_id, 0)
+    else:
+        existing_count = get_exam_question_count(exam_overview_id)
     if existing_count > 0:
         log_batch_progress(current, total, exam_info, "SKIPPED", f"Already has {existing_count} questions")
         return {
@@ -124,12 +149,9 @@ async def process_single_exam(exam_info: Dict[str, Any], current: int, total: in
     start_time = time.time()
     
     try:
-        # Run the pipeline for this exam
-        await run_pipeline(exam=exam, grade=grade, level=level)
-        
-        # Get final question count
-        final_count = get_exam_question_count(exam_overview_id)
-        questions_generated = final_count - existing_count
+        # run_pipeline reports what it saved, so no second COUNT query is needed
+        questions_generated = await run_pipeline(exam=exam, grade=grade, level=level)
+        final_count = existing_count + questions_generated
         
         end_time = time.time()
         duration = end_time - start_time
@@ -169,99 +191,128 @@ async def process_single_exam(exam_info: Dict[str, Any], current: int, total: in
             "error": str(e)
         }
 
-async def run_batch_pipeline(skip_existing: bool = False, max_exams: Optional[int] = None):
+async def run_batch_pipeline(skip_existing: bool = False, max_exams: Optional[int] = None, parallel_workers: int = 3):
     """Run pipeline for all exam overviews"""
-    print("Starting Automated Batch Pipeline for All Exam Overviews")
-    print("=" * 80)
+    configure_engine(parallel_workers)
+    try:
+        return await _run_batch_pipeline(skip_existing, max_exams, parallel_workers)
+    finally:
+        # simple_pipeline's asyncpg connections belong to this event loop; close them before it ends
+        await dispose_engine()
+
+async def _run_batch_pipeline(skip_existing: bool, max_exams: Optional[int], parallel_workers: int):
+    setup_queue_logging()
+    logger.info("Starting Automated Batch Pipeline for All Exam Overviews")
+    logger.info("=" * 80)
     
-    # Get all exam overviews
-    exam_overviews = get_all_exam_overviews()
+    # Get exam overviews (existing-question filter and limit applied in SQL)
+    exam_overviews = get_all_exam_overviews(max_exams=max_exams, only_missing=skip_existing)
     
     if not exam_overviews:
-        print("No exam overviews found in database!")
+        logger.warning("No exam overviews found in database!")
         return
     
-    # Limit number of exams if specified
     if max_exams:
-        exam_overviews = exam_overviews[:max_exams]
-        print(f"Limited to first {max_exams} exams")
+        logger.info(f"Limited to first {max_exams} exams")
     
+    return await _run_exam_overviews(exam_overviews, parallel_workers)
+
+async def _run_exam_overviews(exam_overviews: List[Dict[str, Any]], parallel_workers: int) -> List[Dict[str, Any]]:
+    """Process the given exam overviews concurrently and report a summary"""
     total_exams = len(exam_overviews)
-    print(f"\nProcessing {total_exams} exam overviews...")
+    logger.info(f"Processing {total_exams} exam overviews ({parallel_workers} at a time)...")
+    
+    # Prefetch every exam's question count in one query instead of one per exam
+    question_counts = get_question_counts_for_exams([e["exam_overview_id"] for e in exam_overviews])
+    
+    # Bound concurrency so we don't overwhelm the API
+    sem = asyncio.Semaphore(parallel_workers)
+    finished = 0
+    
+    async def _run(exam_info: Dict[str, Any], index: int) -> Dict[str, Any]:
+        nonlocal finished
+        async with sem:
+            result = await process_single_exam(exam_info, index, total_exams, question_counts)
+        finished += 1
+        logger.info(f"Finished {finished}/{total_exams} exams")
+        return result
+    
+    gathered = await asyncio.gather(
+        *[_run(exam_info, i) for i, exam_info in enumerate(exam_overviews, 1)],
+        return_exceptions=True
+    )
     
     # Track results
     results = []
-    completed = 0
-    skipped = 0
-    failed = 0
-    total_questions_generated = 0
-    
-    # Process each exam sequentially (to avoid overwhelming the API)
-    for i, exam_info in enumerate(exam_overviews, 1):
-        result = await process_single_exam(exam_info, i, total_exams)
+    for exam_info, result in zip(exam_overviews, gathered):
+        if isinstance(result, Exception):
+            result = {
+                "exam_overview_id": exam_info["exam_overview_id"],
+                "exam": exam_info["exam"],
+                "grade": exam_info["grade"],
+                "level": exam_info["level"],
+                "status": "failed",
+                "questions_before": 0,
+                "questions_after": 0,
+                "questions_generated": 0,
+                "error": str(result)
+            }
         results.append(result)
-        
-        # Update counters
-        if result["status"] == "completed":
-            completed += 1
-            total_questions_generated += result["questions_generated"]
-        elif result["status"] == "skipped":
-            skipped += 1
-        else:
-            failed += 1
+    
+    # Aggregate once over the collected results
+    statuses = [result["status"] for result in results]
+    completed = statuses.count("completed")
+    skipped = statuses.count("skipped")
+    failed = len(statuses) - completed - skipped
+    total_questions_generated = sum(result["questions_generated"] for result in results)
     
     # Print final summary
-    print("\n" + "=" * 80)
-    print("BATCH PIPELINE COMPLETE!")
-    print("=" * 80)
-    print(f"Total Exams Processed: {total_exams}")
-    print(f"  ✅ Completed: {completed}")
-    print(f"  ⏭️  Skipped: {skipped}")
-    print(f"  ❌ Failed: {failed}")
-    print(f"Total Questions Generated: {total_questions_generated}")
-    print("=" * 80)
+    logger.info("=" * 80)
+    logger.info("BATCH PIPELINE COMPLETE!")
+    logger.info("=" * 80)
+    logger.info(f"Total Exams Processed: {total_exams}")
+    logger.info(f"  ✅ Completed: {completed}")
+    logger.info(f"  ⏭️  Skipped: {skipped}")
+    logger.info(f"  ❌ Failed: {failed}")
+    logger.info(f"Total Questions Generated: {total_questions_generated}")
+    logger.info("=" * 80)
     
     # Print detailed results
-    print("\nDETAILED RESULTS:")
-    print("-" * 80)
+    logger.info("DETAILED RESULTS:")
+    logger.info("-" * 80)
     for result in results:
         status_icon = "✅" if result["status"] == "completed" else "⏭️" if result["status"] == "skipped" else "❌"
-        print(f"{status_icon} {result['exam']} Grade {result['grade']} Level {result['level']}: "
-              f"{result['questions_generated']} questions generated")
+        logger.info(f"{status_icon} {result['exam']} Grade {result['grade']} Level {result['level']}: "
+                    f"{result['questions_generated']} questions generated")
         if result["error"]:
-            print(f"   Error: {result['error']}")
+            logger.error(f"   Error: {result['error']}")
     
     return results
 
-async def run_batch_pipeline_with_resume():
+async def run_batch_pipeline_with_resume(parallel_workers: int = 3):
     """Run batch pipeline with resume capability"""
-    print("Starting Batch Pipeline with Resume Capability")
-    print("=" * 80)
-    
-    # Get all exam overviews
-    exam_overviews = get_all_exam_overviews()
-    
-    if not exam_overviews:
-        print("No exam overviews found in database!")
-        return
+    configure_engine(parallel_workers)
+    try:
+        return await _run_batch_pipeline_with_resume(parallel_workers)
+    finally:
+        await dispose_engine()
+
+async def _run_batch_pipeline_with_resume(parallel_workers: int):
+    setup_queue_logging()
+    logger.info("Starting Batch Pipeline with Resume Capability")
+    logger.info("=" * 80)
     
-    # Filter out exams that already have questions
-    remaining_exams = []
-    for exam in exam_overviews:
-        if not check_exam_has_questions(exam["exam_overview_id"]):
-            remaining_exams.append(exam)
-        else:
-            count = get_exam_question_count(exam["exam_overview_id"])
-            print(f"⏭️  Skipping {exam['exam']} Grade {exam['grade']} Level {exam['level']} - already has {count} questions")
+    # Only exams without questions, in one query instead of a count per exam
+    remaining_exams = get_all_exam_overviews(only_missing=True)
     
     if not remaining_exams:
-        print("All exams already have questions generated!")
+        logger.info("All exams already have questions generated!")
         return
     
-    print(f"\nFound {len(remaining_exams)} exams that need question generation")
+    logger.info(f"Found {len(remaining_exams)} exams that need question generation")
     
-    # Process remaining exams
-    await run_batch_pipeline(skip_existing=False, max_exams=len(remaining_exams))
+    # Process exactly the remaining exams
+    return await _run_exam_overviews(remaining_exams, parallel_workers)
 
 if __name__ == "__main__":
     # Choose your processing mode:
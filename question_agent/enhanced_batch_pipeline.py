@@ -10,124 +10,189 @@ This version includes:
 """
 
 import os
+import json
+import hashlib
 import asyncio
 import time
+import random
 import logging
 from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
-from simple_pipeline import run_pipeline
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from simple_pipeline import run_pipeline, configure_engine, dispose_engine, _async_database_url
 from batch_config import BatchConfig, DEFAULT_CONFIG, TEST_CONFIG, PRODUCTION_CONFIG
+from logging_config import setup_queue_logging
+from rate_limiter import TokenBucket
+
+try:
+    import orjson  # optional, faster result serialization
+except ImportError:
+    orjson = None
 
 # Load environment
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Database setup
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine)
+# Database setup (async, so DB waits don't block other exams' LLM calls).
+# asyncpg prepares each distinct statement once per connection and reuses it afterwards,
+# which is why queries below keep a fixed SQL text.
+engine = create_async_engine(
+    _async_database_url(DATABASE_URL),
+    pool_pre_ping=True,
+    query_cache_size=1200,
+    connect_args={"prepared_statement_cache_size": 256}
+)
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+
+# Static text so SQLAlchemy's compiled cache (and PostgreSQL's plan cache) sees one statement
+# regardless of which filters are set
+FILTERED_EXAM_OVERVIEWS_QUERY = text("""
+    SELECT exam_overview_id, exam, grade, level, total_questions, total_marks, total_time_mins
+    FROM exam_overview
+    WHERE (CAST(:exam_filter AS text[]) IS NULL OR exam = ANY(CAST(:exam_filter AS text[])))
+      AND (CAST(:grade_filter AS int[]) IS NULL OR grade = ANY(CAST(:grade_filter AS int[])))
+      AND (CAST(:level_filter AS int[]) IS NULL OR level = ANY(CAST(:level_filter AS int[])))
+      -- Skip exams that already have questions in SQL rather than one count query per exam
+      AND (NOT :skip_existing OR NOT EXISTS (
+          SELECT 1
+          FROM syllabus s
+          JOIN questions q ON q.syllabus_id = s.syllabus_id
+          WHERE s.exam_overview_id = exam_overview.exam_overview_id
+      ))
+    ORDER BY exam, grade, level
+    LIMIT :max_exams
+""")
+
+# Module-level logger; looked up once instead of on every call
+logger = logging.getLogger("enhanced_batch_pipeline")
 
 # Setup logging
 def setup_logging(config: BatchConfig):
     """Setup logging based on configuration"""
+    handlers = [logging.StreamHandler()]
     if config.log_to_file:
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(config.log_file_path),
-                logging.StreamHandler()
-            ]
-        )
-    else:
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s'
-        )
+        handlers.insert(0, logging.FileHandler(config.log_file_path))
+    # Records are written by a background listener thread, so workers only enqueue
+    setup_queue_logging(level=logging.INFO, handlers=handlers)
     
-    return logging.getLogger(__name__)
+    return logger
 
-def get_filtered_exam_overviews(config: BatchConfig) -> List[Dict[str, Any]]:
+# exam_overview rows are reference data, so identical filter sets reuse them within a process.
+# Results filtered by skip_existing depend on generated questions and are never cached.
+_exam_overview_cache: Dict[tuple, List[Dict[str, Any]]] = {}
+
+def clear_exam_overview_cache():
+    """Forget memoized get_filtered_exam_overviews results"""
+    _exam_overview_cache.clear()
+
+async def get_filtered_exam_overviews(session: AsyncSession, config: BatchConfig) -> List[Dict[str, Any]]:
     """Fetch exam overviews with filtering applied"""
-    logger = logging.getLogger(__name__)
+    
+    # Filters are tuples on the frozen config, so they hash directly
+    cache_key = (config.exam_filter, config.grade_filter, config.level_filter, config.max_exams)
+    if not config.skip_existing and cache_key in _exam_overview_cache:
+        logger.info("Using cached exam overviews for these filters")
+        return list(_exam_overview_cache[cache_key])
+    
     logger.info("Fetching exam overviews with filters applied...")
     
-    with SessionLocal() as session:
-        # Build dynamic query based on filters
-        where_conditions = []
-        params = {}
-        
-        if config.exam_filter:
-            where_conditions.append("exam = ANY(:exam_filter)")
-            params["exam_filter"] = config.exam_filter
-        
-        if config.grade_filter:
-            where_conditions.append("grade = ANY(:grade_filter)")
-            params["grade_filter"] = config.grade_filter
-        
-        if config.level_filter:
-            where_conditions.append("level = ANY(:level_filter)")
-            params["level_filter"] = config.level_filter
-        
-        where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
-        
-        query = text(f"""
-            SELECT exam_overview_id, exam, grade, level, total_questions, total_marks, total_time_mins
-            FROM exam_overview
-            WHERE {where_clause}
-            ORDER BY exam, grade, level
-        """)
-        
-        result = session.execute(query, params)
-        exam_overviews = []
-        
-        for row in result:
-            exam_overviews.append({
-                "exam_overview_id": row.exam_overview_id,
-                "exam": row.exam,
-                "grade": row.grade,
-                "level": row.level,
-                "total_questions": row.total_questions,
-                "total_marks": row.total_marks,
-                "total_time_mins": row.total_time_mins
-            })
-    
-    logger.info(f"Found {len(exam_overviews)} exam overviews matching filters:")
-    for exam in exam_overviews:
-        logger.info(f"  - {exam['exam']} Grade {exam['grade']} Level {exam['level']} ({exam['total_questions']} questions)")
+    # One statement for every filter combination; unused filters are bound as NULL
+    params = {
+        "exam_filter": list(config.exam_filter) if config.exam_filter else None,  # lists bind as arrays
+        "grade_filter": list(config.grade_filter) if config.grade_filter else None,
+        "level_filter": list(config.level_filter) if config.level_filter else None,
+        "skip_existing": config.skip_existing,
+        "max_exams": config.max_exams or None  # LIMIT NULL means no limit in PostgreSQL
+    }
+    
+    result = await session.execute(FILTERED_EXAM_OVERVIEWS_QUERY, params)
+    # Build the dicts straight from the row mappings (column names match the keys)
+    exam_overviews = [dict(row) for row in result.mappings()]
+    
+    if not config.skip_existing:
+        _exam_overview_cache[cache_key] = list(exam_overviews)
+    
+    logger.info(f"Found {len(exam_overviews)} exam overviews matching filters")
+    # Per-exam listing is one log record per row, so only emit it in verbose mode
+    if config.verbose:
+        for exam in exam_overviews:
+            logger.info(f"  - {exam['exam']} Grade {exam['grade']} Level {exam['level']} ({exam['total_questions']} questions)")
     
     return exam_overviews
 
-def check_exam_has_questions(exam_overview_id: int) -> bool:
-    """Check if exam already has questions generated"""
-    with SessionLocal() as session:
-        query = text("""
-            SELECT COUNT(*) as question_count
-            FROM questions q
-            JOIN syllabus s ON q.syllabus_id = s.syllabus_id
-            WHERE s.exam_overview_id = :exam_id
-        """)
-        result = session.execute(query, {"exam_id": exam_overview_id})
-        count = result.scalar()
-        return count > 0
+QUESTION_COUNTS_QUERY = text("""
+    SELECT s.exam_overview_id, COUNT(*) AS question_count
+    FROM questions q
+    JOIN syllabus s ON q.syllabus_id = s.syllabus_id
+    WHERE s.exam_overview_id = ANY(:exam_ids)
+    GROUP BY s.exam_overview_id
+""")
+
+async def get_question_counts_for_exams(session: AsyncSession, exam_ids: List[int]) -> Dict[int, int]:
+    """Get current question counts for many exams in one query (exams without questions are omitted)"""
+    if not exam_ids:
+        return {}
+    result = await session.execute(QUESTION_COUNTS_QUERY, {"exam_ids": list(exam_ids)})
+    return {row.exam_overview_id: row.question_count for row in result}
 
-def get_exam_question_count(exam_overview_id: int) -> int:
+async def get_exam_question_count(session: AsyncSession, exam_overview_id: int) -> int:
     """Get current question count for an exam"""
-    with SessionLocal() as session:
-        query = text("""
-            SELECT COUNT(*) as question_count
-            FROM questions q
-            JOIN syllabus s ON q.syllabus_id = s.syllabus_id
-            WHERE s.exam_overview_id = :exam_id
-        """)
-        result = session.execute(query, {"exam_id": exam_overview_id})
-        return result.scalar()
+    counts = await get_question_counts_for_exams(session, [exam_overview_id])
+    return counts.get(exam_overview_id, 0)
+
+def checkpoint_path_for(config: BatchConfig) -> Optional[str]:
+    """
+    Checkpoint file for this run's selection of exams (None when checkpoints are disabled)
+    
+    config.checkpoint_path gets a short fingerprint of the filters, max_exams and skip_existing,
+    so only a re-run of the same batch resumes from it; an unrelated run neither replays its
+    results nor deletes it.
+    """
+    if not config.checkpoint_path:
+        return None
+    fingerprint = json.dumps([
+        config.exam_filter, config.grade_filter, config.level_filter, config.max_exams, config.skip_existing
+    ])
+    root, ext = os.path.splitext(config.checkpoint_path)
+    return f"{root}.{hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:12]}{ext}"
+
+def load_checkpoint(path: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    """Load exam_overview_id -> result of each exam completed by an interrupted run"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Dict[str, Any]]):
+    """Write the checkpoint atomically so a crash mid-write never corrupts it"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(checkpoint, fh)
+    os.replace(tmp_path, path)
+
+def _dumps_result(result: Dict[str, Any]) -> str:
+    if orjson is not None:
+        return orjson.dumps(result).decode("utf-8")
+    return json.dumps(result, ensure_ascii=False)
 
-async def process_single_exam_with_retry(exam_info: Dict[str, Any], config: BatchConfig, current: int, total: int) -> Dict[str, Any]:
-    """Process a single exam with retry logic"""
-    logger = logging.getLogger(__name__)
+def _iter_results_file(path: str):
+    """Yield result dicts back from a JSONL results file, one line at a time"""
+    with open(path, "r", encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                yield json.loads(line)
+
+async def process_single_exam_with_retry(exam_info: Dict[str, Any], config: BatchConfig, current: int, total: int,
+                                         question_counts: Optional[Dict[int, int]] = None,
+                                         checkpoint: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Process a single exam with retry logic
+    
+    question_counts: prefetched counts from get_question_counts_for_exams
+    checkpoint: exams already finished by an interrupted run (see load_checkpoint)
+    """
     exam_overview_id = exam_info["exam_overview_id"]
     exam = exam_info["exam"]
     grade = exam_info["grade"]
@@ -135,8 +200,18 @@ async def process_single_exam_with_retry(exam_info: Dict[str, Any], config: Batc
     
     logger.info(f"Processing {current}/{total}: {exam} Grade {grade} Level {level}")
     
+    # Finished by an earlier, interrupted run? Replay its stored result without touching the DB
+    stored = checkpoint.get(str(exam_overview_id)) if checkpoint is not None else None
+    if stored is not None:
+        logger.info(f"Skipping {exam} Grade {grade} Level {level} - completed in the interrupted run")
+        return {**stored, "resumed": True}
+    
     # Check if exam already has questions
-    existing_count = get_exam_question_count(exam_overview_id)
+    if question_counts is not None:
+        existing_count = question_counts.get(exam_overview_id, 0)
+    else:
+        async with SessionLocal() as session:
+            existing_count = await get_exam_question_count(session, exam_overview_id)
     if config.skip_existing and existing_count > 0:
         logger.info(f"Skipping {exam} Grade {grade} Level {level} - already has {existing_count} questions")
         return {
@@ -158,19 +233,16 @@ async def process_single_exam_with_retry(exam_info: Dict[str, Any], config: Batc
         try:
             start_time = time.time()
             
-            # Run the pipeline for this exam
-            await run_pipeline(exam=exam, grade=grade, level=level)
-            
-            # Get final question count
-            final_count = get_exam_question_count(exam_overview_id)
-            questions_generated = final_count - existing_count
+            # run_pipeline reports what it saved, so no second COUNT query is needed
+            questions_generated = await run_pipeline(exam=exam, grade=grade, level=level)
+            final_count = existing_count + questions_generated
             
             end_time = time.time()
             duration = end_time - start_time
             
             logger.info(f"✅ Completed {exam} Grade {grade} Level {level}: {questions_generated} questions in {duration:.1f}s")
             
-            return {
+            result = {
                 "exam_overview_id": exam_overview_id,
                 "exam": exam,
                 "grade": grade,
@@ -184,12 +256,21 @@ async def process_single_exam_with_retry(exam_info: Dict[str, Any], config: Batc
                 "retries": attempt
             }
             
+            checkpoint_path = checkpoint_path_for(config)
+            if checkpoint is not None and checkpoint_path:
+                checkpoint[str(exam_overview_id)] = result
+                save_checkpoint(checkpoint_path, checkpoint)
+            
+            return result
+            
         except Exception as e:
             last_error = e
             if attempt < config.max_retries:
                 logger.warning(f"⚠️  Attempt {attempt + 1} failed for {exam} Grade {grade} Level {level}: {e}")
-                logger.info(f"Retrying in {config.delay_between_exams} seconds...")
-                await asyncio.sleep(config.delay_between_exams)
+                # Exponential backoff with jitter so concurrent workers don't retry in lock-step
+                delay = min(30, config.delay_between_exams * (2 ** attempt)) + random.uniform(0, 1)
+                logger.info(f"Retrying in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
             else:
                 logger.error(f"❌ Failed {exam} Grade {grade} Level {level} after {config.max_retries + 1} attempts: {e}")
     
@@ -210,42 +291,85 @@ async def process_single_exam_with_retry(exam_info: Dict[str, Any], config: Batc
 
 async def run_enhanced_batch_pipeline(config: BatchConfig = DEFAULT_CONFIG):
     """Run enhanced batch pipeline with configuration"""
-    logger = setup_logging(config)
+    configure_engine(config.max_concurrency)
+    try:
+        return await _run_enhanced_batch_pipeline(config)
+    finally:
+        # Pooled asyncpg connections (ours and simple_pipeline's) belong to this event loop;
+        # close them before it ends
+        await engine.dispose()
+        await dispose_engine()
+
+async def _run_enhanced_batch_pipeline(config: BatchConfig):
+    setup_logging(config)
     logger.info("Starting Enhanced Batch Pipeline")
     logger.info("=" * 80)
     
-    # Get filtered exam overviews
-    exam_overviews = get_filtered_exam_overviews(config)
+    # One read-only session for all admission queries; workers never share it
+    async with SessionLocal() as session:
+        await session.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+        
+        # Get filtered exam overviews
+        exam_overviews = await get_filtered_exam_overviews(session, config)
+        
+        # Prefetch every exam's question count in one query instead of one per exam
+        question_counts = await get_question_counts_for_exams(session, [e["exam_overview_id"] for e in exam_overviews])
     
     if not exam_overviews:
         logger.info("No exam overviews found matching the filters!")
         return []
     
-    # Apply max_exams limit
+    # max_exams is applied as a SQL LIMIT
     if config.max_exams:
-        exam_overviews = exam_overviews[:config.max_exams]
         logger.info(f"Limited to first {config.max_exams} exams")
     
     total_exams = len(exam_overviews)
-    logger.info(f"Processing {total_exams} exam overviews...")
-    
-    # Track results
-    results = []
-    completed = 0
-    skipped = 0
-    failed = 0
-    total_questions_generated = 0
-    total_duration = 0
+    logger.info(f"Processing {total_exams} exam overviews ({config.max_concurrency} at a time)...")
     
     start_time = time.time()
     
-    # Process each exam
-    for i, exam_info in enumerate(exam_overviews, 1):
-        try:
-            result = await process_single_exam_with_retry(exam_info, config, i, total_exams)
-            results.append(result)
+    # Resume: exams finished by an interrupted run are skipped
+    checkpoint_path = checkpoint_path_for(config)
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint:
+        logger.info(f"Resuming: {len(checkpoint)} exams already completed in the interrupted run")
+    
+    # Exams are independent, so run them concurrently (bounded so we don't overwhelm the API)
+    sem = asyncio.Semaphore(config.max_concurrency)
+    
+    # Optional global pacing: waits only when the start rate would exceed the cap
+    start_bucket = TokenBucket(config.max_exams_per_minute) if config.max_exams_per_minute else None
+    
+    async def _worker(exam_info: Dict[str, Any], index: int):
+        # Wait for the start token before taking a slot, so pacing never idles a concurrency slot
+        if start_bucket:
+            await start_bucket.acquire()
+        async with sem:
+            result = await process_single_exam_with_retry(exam_info, config, index, total_exams, question_counts, checkpoint)
+        return index, result
+    
+    tasks = [asyncio.create_task(_worker(exam_info, i)) for i, exam_info in enumerate(exam_overviews, 1)]
+    
+    # Stream results to disk as they finish; only counters (and optionally the full list) stay in memory
+    keep_results = config.return_full_results or (config.verbose and not config.results_path)
+    indexed_results = []
+    finished = completed = skipped = failed = 0
+    total_questions_generated = 0
+    total_duration = 0
+    # A resumed run appends to the interrupted run's results; only a fresh run starts the file over
+    results_mode = "a" if checkpoint else "w"
+    results_file = open(config.results_path, results_mode, encoding="utf-8") if config.results_path else None
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                index, result = await next_done
+            except Exception as e:
+                logger.error(f"Unexpected error processing exam: {e}")
+                if not config.continue_on_error:
+                    break
+                continue
             
-            # Update counters
+            finished += 1
             if result["status"] == "completed":
                 completed += 1
                 total_questions_generated += result["questions_generated"]
@@ -254,18 +378,29 @@ async def run_enhanced_batch_pipeline(config: BatchConfig = DEFAULT_CONFIG):
                 skipped += 1
             else:
                 failed += 1
-                if not config.continue_on_error:
-                    logger.error("Stopping batch processing due to error (continue_on_error=False)")
-                    break
             
-            # Add delay between exams
-            if i < total_exams and config.delay_between_exams > 0:
-                await asyncio.sleep(config.delay_between_exams)
-                
-        except Exception as e:
-            logger.error(f"Unexpected error processing exam {i}: {e}")
-            if not config.continue_on_error:
+            # Replayed results are already in the file from the interrupted run
+            if results_file and not result.get("resumed"):
+                results_file.write(_dumps_result(result) + "\n")
+            if keep_results:
+                indexed_results.append((index, result))
+            logger.info(f"Finished {finished}/{total_exams} exams")
+            
+            if result["status"] == "failed" and not config.continue_on_error:
+                logger.error("Stopping batch processing due to error (continue_on_error=False)")
                 break
+    finally:
+        if results_file:
+            results_file.close()
+    
+    # Cancel whatever is still queued/running after an early stop
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    
+    # A clean, complete run has nothing to resume
+    if failed == 0 and finished == total_exams and checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
     
     end_time = time.time()
     total_batch_duration = end_time - start_time
@@ -281,13 +416,19 @@ async def run_enhanced_batch_pipeline(config: BatchConfig = DEFAULT_CONFIG):
     logger.info(f"Total Questions Generated: {total_questions_generated}")
     logger.info(f"Total Processing Time: {total_batch_duration:.1f} seconds")
     logger.info(f"Average Time per Exam: {total_batch_duration/total_exams:.1f} seconds")
+    if config.results_path:
+        logger.info(f"Per-exam results written to {config.results_path}")
     logger.info("=" * 80)
     
+    # Report in the original exam order when the results were kept in memory
+    results = [result for _, result in sorted(indexed_results, key=lambda item: item[0])]
+    
     # Print detailed results
     if config.verbose:
         logger.info("\nDETAILED RESULTS:")
         logger.info("-" * 80)
-        for result in results:
+        # Read back from the results file rather than holding every result in memory
+        for result in (_iter_results_file(config.results_path) if config.results_path else results):
             status_icon = "✅" if result["status"] == "completed" else "⏭️" if result["status"] == "skipped" else "❌"
             retry_info = f" (retries: {result.get('retries', 0)})" if result.get('retries', 0) > 0 else ""
             logger.info(f"{status_icon} {result['exam']} Grade {result['grade']} Level {result['level']}: "
@@ -295,7 +436,18 @@ async def run_enhanced_batch_pipeline(config: BatchConfig = DEFAULT_CONFIG):
             if result["error"]:
                 logger.info(f"   Error: {result['error']}")
     
-    return results
+    if config.return_full_results:
+        return results
+    return {
+        "total_exams": total_exams,
+        "completed": completed,
+        "skipped": skipped,
+        "failed": failed,
+        "total_questions_generated": total_questions_generated,
+        "generation_seconds": total_duration,
+        "batch_seconds": total_batch_duration,
+        "results_path": config.results_path
+    }
 
 # Convenience functions for different use cases
 async def run_test_batch():
@@ -0,0 +1,37 @@
+"""
+Non-blocking Logging Setup
+
+Workers only enqueue log records; a single QueueListener thread formats and writes them,
+so parallel exams/sections don't contend on stdout.
+"""
+
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Optional
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_listener: Optional[QueueListener] = None
+
+def setup_queue_logging(level: int = logging.INFO, handlers: Optional[List[logging.Handler]] = None) -> None:
+    """Route all logging through a background QueueListener (safe to call more than once)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    if handlers is None:
+        handlers = [logging.StreamHandler()]
+    formatter = logging.Formatter(LOG_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(-1)  # unbounded, so put() never blocks a worker
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -1,5 +1,7 @@
+import sys
 import json
-from typing import List, Dict, Any
+from functools import lru_cache
+from typing import List, Dict, Any, Tuple
 
 SYSTEM_PROMPT = (
     "You are an expert Olympiad Question Creator specializing in given exam,grade and level.\n"
@@ -40,11 +42,74 @@ SYSTEM_PROMPT = (
     "Avoid template phrasing; ensure each question is novel with distinct numbers, objects, or contexts.\n"
     "Return ONLY the JSON object; no extra text or markdown.\n"
 )
+# Shared by every agent call and cache key; intern so all references hit one object
+SYSTEM_PROMPT = sys.intern(SYSTEM_PROMPT)
 
 def _difficulty_for_level(level: int) -> str:
     # return "easy" if level <= 1 else ("medium" if level == 2 else "hard")
     return "easy"
 
+# Static parts of the user prompt, built once at import instead of per section
+USER_PROMPT_PREAMBLE = sys.intern(
+    """
+            - The number of generated questions must be exactly equal to the number of items in syllabus_pool (one question per syllabus_id).
+            - Each question must strictly reference its syllabus_id from syllabus_pool:
+            * If both topic and subtopic are available, use both in framing the question.
+            * If only topic is available, use the topic alone.
+            - Do not invent extra topics or subtopics outside syllabus_pool.
+            - Ensure every syllabus_id from the pool is used exactly once, mapped to a unique question.
+
+            - Additionally, reference_topics is provided as a list of topics to cover:
+            * Ensure that these reference_topics are incorporated into the questions where relevant.
+            * Distribute them naturally across the questions so all reference_topics are covered at least once.
+            * Priority is: follow syllabus_pool strictly for structure, and then align/reference with reference_topics.
+        """
+)
+
+OUTPUT_SCHEMA_TEXT = sys.intern(
+    "OUTPUT SCHEMA (strict JSON):\n"
+    "{\n"
+    "  \"questions\": [\n"
+    "    {\n"
+    "      \"syllabus_id\": <int>,\n"
+    "      \"difficulty\": \"easy\" | \"medium\" | \"hard\",\n"
+    "      \"question_text\": <string>,\n"
+    "      \"option_a\": <string>,\n"
+    "      \"option_b\": <string>,\n"
+    "      \"option_c\": <string>,\n"
+    "      \"option_d\": <string>,\n"
+    "      \"correct_option\": \"A\" | \"B\" | \"C\" | \"D\",\n"
+    "      \"solution\": <string>,\n"
+    "      \"is_active\": true\n"
+    "    }\n"
+    "  ]\n"
+    "}\n\n"
+)
+
+def _rules_for_grade(grade: int) -> str:
+    return (
+        "Rules:\n"
+        f"- Return exactly told items in questions.\n"
+        "- Use subtopic details in the question when provided.\n"
+        "- Options must be unique and plausible; avoid 'All/None of the above'.\n"
+        "- Do not repeat question stems; ensure varied contexts and numbers.\n"
+        f"- Questions should be educational and age-appropriate for Grade {grade}.\n"
+        "- Include clear explanations in solutions.\n"
+        "- Return ONLY the JSON object; no markdown or commentary."
+    )
+
+@lru_cache(maxsize=256)
+def prompt_template_for(exam: str, grade: int, level: int, section_name: str) -> Tuple[str, str]:
+    """Pre-rendered (prefix, suffix) around the per-call topic list and syllabus pool"""
+    difficulty = _difficulty_for_level(level)
+    prefix = (
+        USER_PROMPT_PREAMBLE
+        + f"Section: {section_name}, Exam: {exam} Grade: {grade}, Level: {level}.\n"
+        + f"Difficulty: {difficulty}.\n"
+    )
+    suffix = OUTPUT_SCHEMA_TEXT + _rules_for_grade(grade)
+    return prefix, suffix
+
 def make_user_prompt_for_section(
     section_name: str,
     topics: List[Dict[str, Any]],
@@ -52,8 +117,6 @@ def make_user_prompt_for_section(
     grade: int,
     level: int,
 ) -> str:
-    difficulty = _difficulty_for_level(level)
-
     # Create topics preview
     topics_list = []
     syllabus_options = []
@@ -69,52 +132,13 @@ def make_user_prompt_for_section(
         })
 
     topics_text = ", ".join(topics_list)
+    # Default separators on purpose: the rendered prompt feeds response-cache keys and
+    # OpenAI's prompt-prefix cache, so its text must not change
     pool_json = json.dumps(syllabus_options, ensure_ascii=False)
 
+    # Only the topic lists vary per call; prefix/suffix are rendered once per exam section
+    prefix, suffix = prompt_template_for(exam, grade, level, section_name)
     return (
-        f"""
-            - The number of generated questions must be exactly equal to the number of items in syllabus_pool (one question per syllabus_id).
-            - Each question must strictly reference its syllabus_id from syllabus_pool:
-            * If both topic and subtopic are available, use both in framing the question.
-            * If only topic is available, use the topic alone.
-            - Do not invent extra topics or subtopics outside syllabus_pool.
-            - Ensure every syllabus_id from the pool is used exactly once, mapped to a unique question.
-
-            - Additionally, reference_topics is provided as a list of topics to cover:
-            * Ensure that these reference_topics are incorporated into the questions where relevant.
-            * Distribute them naturally across the questions so all reference_topics are covered at least once.
-            * Priority is: follow syllabus_pool strictly for structure, and then align/reference with reference_topics.
-        """
-        # f"Task: Generate a QuestionBatch JSON with exactly 2 MCQs.\n"
-        f"Section: {section_name}, Exam: {exam} Grade: {grade}, Level: {level}.\n"
-        f"Difficulty: {difficulty}.\n"
-        f"Topics to cover: {topics_text}\n"
-        f"Available syllabus options (choose one syllabus_id per question): {pool_json}\n\n"
-
-        "OUTPUT SCHEMA (strict JSON):\n"
-            "{\n"
-        "  \"questions\": [\n"
-        "    {\n"
-        "      \"syllabus_id\": <int>,\n"
-        "      \"difficulty\": \"easy\" | \"medium\" | \"hard\",\n"
-        "      \"question_text\": <string>,\n"
-        "      \"option_a\": <string>,\n"
-        "      \"option_b\": <string>,\n"
-        "      \"option_c\": <string>,\n"
-        "      \"option_d\": <string>,\n"
-        "      \"correct_option\": \"A\" | \"B\" | \"C\" | \"D\",\n"
-        "      \"solution\": <string>,\n"
-        "      \"is_active\": true\n"
-        "    }\n"
-        "  ]\n"
-        "}\n\n"
-
-        "Rules:\n"
-        f"- Return exactly told items in questions.\n"
-        "- Use subtopic details in the question when provided.\n"
-        "- Options must be unique and plausible; avoid 'All/None of the above'.\n"
-        "- Do not repeat question stems; ensure varied contexts and numbers.\n"
-        f"- Questions should be educational and age-appropriate for Grade {grade}.\n"
-        "- Include clear explanations in solutions.\n"
-        "- Return ONLY the JSON object; no markdown or commentary."
-    )
\ No newline at end of file
+        f"{prefix}Topics to cover: {topics_text}\n"
+        f"Available syllabus options (choose one syllabus_id per question): {pool_json}\n\n{suffix}"
+    )
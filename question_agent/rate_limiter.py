@@ -0,0 +1,87 @@
+"""
+Client-side Rate Limiting for LLM Calls
+
+Token buckets for requests-per-minute and tokens-per-minute, keyed per provider+model,
+so parallel sections/exams stay under the account quota instead of bouncing off 429s.
+Limiters hold asyncio locks, so they are kept per event loop (one set per asyncio.run).
+"""
+
+import os
+import time
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+from typing import Dict, Tuple
+
+# Default (requests/min, tokens/min) per provider; override with e.g. OPENAI_REQUESTS_PER_MINUTE
+DEFAULT_LIMITS: Dict[str, Tuple[int, int]] = {
+    "openai": (500, 30000),
+}
+
+class TokenBucket:
+    """Token bucket refilled continuously up to `per_minute` capacity"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        """Wait until `amount` tokens are available and take them"""
+        amount = min(amount, self.capacity)
+        while True:
+            # Only the check-and-take is locked; waiters sleep outside it, side by side
+            async with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+    def refund(self, amount: float):
+        """Give back unused tokens (a negative amount charges an underestimate)"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class RateLimiter:
+    """Requests-per-minute + tokens-per-minute limiter for one provider/model"""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    @asynccontextmanager
+    async def reserve(self, estimated_tokens: int):
+        await self.requests.acquire()
+        await self.tokens.acquire(estimated_tokens)
+        yield self
+
+    def refund(self, unused_tokens: int):
+        self.tokens.refund(unused_tokens)
+
+_LIMITERS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, RateLimiter]]" = weakref.WeakKeyDictionary()
+
+def get_limiter(provider: str, model: str) -> RateLimiter:
+    """Get the running loop's shared limiter for a provider+model, creating it from env/defaults on first use"""
+    limiters = _LIMITERS.setdefault(asyncio.get_running_loop(), {})
+    key = f"{provider}:{model}"
+    if key not in limiters:
+        default_rpm, default_tpm = DEFAULT_LIMITS.get(provider, (60, 100000))
+        prefix = provider.upper()
+        limiters[key] = RateLimiter(
+            requests_per_minute=float(os.getenv(f"{prefix}_REQUESTS_PER_MINUTE", default_rpm)),
+            tokens_per_minute=float(os.getenv(f"{prefix}_TOKENS_PER_MINUTE", default_tpm)),
+        )
+    return limiters[key]
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token)"""
+    return len(text) // 4 + 1
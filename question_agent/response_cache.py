@@ -0,0 +1,72 @@
+"""
+Persistent Response Cache for the Question Agent
+
+Exact-match cache keyed on a hash of the full prompt + model settings, stored in a local
+SQLite file under question_agent/_cache/. Identical agent calls (retries, re-runs of a
+failed batch) return the stored payload instead of paying for another LLM round trip.
+
+Disabled by default because re-running an exam is normally meant to produce NEW questions;
+enable with QUESTION_CACHE_ENABLED=1.
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import time
+from typing import Any, Dict, Optional
+
+try:
+    import orjson  # optional, faster (de)serialization of cached payloads
+except ImportError:
+    orjson = None
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_cache")
+CACHE_PATH = os.path.join(CACHE_DIR, "responses.sqlite3")
+
+def cache_enabled() -> bool:
+    return os.getenv("QUESTION_CACHE_ENABLED", "0").lower() in ("1", "true", "yes")
+
+def make_cache_key(*parts: Any) -> str:
+    """Stable sha256 over all inputs that influence the LLM response"""
+    raw = "\x1f".join(str(p) for p in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(CACHE_PATH, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+    return conn
+
+def get_cached(key: str) -> Optional[Dict[str, Any]]:
+    """Return the cached payload for `key`, or None on miss"""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT payload FROM responses WHERE key = ?", (key,)).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    return orjson.loads(row[0]) if orjson is not None else json.loads(row[0])
+
+def set_cached(key: str, payload: Dict[str, Any]):
+    """Store `payload` under `key` (overwrites any previous entry)"""
+    if orjson is not None:
+        raw = orjson.dumps(payload).decode("utf-8")
+    else:
+        raw = json.dumps(payload, ensure_ascii=False)
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, payload, created_at) VALUES (?, ?, ?)",
+                (key, raw, time.time())
+            )
+    finally:
+        conn.close()
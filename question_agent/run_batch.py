@@ -34,9 +34,11 @@ async def main():
     parser.add_argument('--no-skip-existing', action='store_false', dest='skip_existing',
                        help='Process all exams even if they have questions (default behavior)')
     parser.add_argument('--delay', type=float, default=1.0, 
-                       help='Delay between exams in seconds')
+                       help='Base delay in seconds before retrying a failed exam')
     parser.add_argument('--retries', type=int, default=3, 
                        help='Maximum retries for failed exams')
+    parser.add_argument('--concurrency', type=int, default=8, 
+                       help='Maximum number of exams processed at the same time')
     parser.add_argument('--verbose', action='store_true', default=True, 
                        help='Enable verbose logging')
     
@@ -46,8 +48,9 @@ async def main():
     print("=" * 60)
     print(f"Mode: {args.mode}")
     print(f"Skip existing: {args.skip_existing}")
-    print(f"Delay between exams: {args.delay}s")
+    print(f"Retry delay: {args.delay}s")
     print(f"Max retries: {args.retries}")
+    print(f"Concurrency: {args.concurrency}")
     print("=" * 60)
     
     try:
@@ -69,6 +72,7 @@ async def main():
                 skip_existing=args.skip_existing,
                 delay_between_exams=args.delay,
                 max_retries=args.retries,
+                max_concurrency=args.concurrency,
                 verbose=args.verbose
             )
             await run_enhanced_batch_pipeline(config)
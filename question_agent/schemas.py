@@ -1,9 +1,15 @@
+import logging
 from typing import List, Literal
 from pydantic import BaseModel, Field, model_validator
 
 Difficulty = Literal["easy", "medium", "hard"]
 CorrectKey = Literal["A", "B", "C", "D"]
 
+logger = logging.getLogger("batch")
+
+# Compared against stripped, lower-cased options
+_BANNED = frozenset(("all of the above", "none of the above", "all of these", "none of these"))
+
 class QuestionItem(BaseModel):
     syllabus_id: int
     difficulty: Difficulty
@@ -15,16 +21,6 @@ class QuestionItem(BaseModel):
     correct_option: CorrectKey
     solution: str = Field(..., min_length=10)
     is_active: bool = True
-    _valid: bool = True  # internal flag
-
-    @model_validator(mode="after")
-    def validate_options(self):
-        opts = [self.option_a.strip(), self.option_b.strip(), self.option_c.strip(), self.option_d.strip()]
-        banned = {"All of the above", "None of the above", "All of these", "None of these"}
-
-        if len(set(opts)) != 4 or any(o in banned for o in opts):
-            self._valid = False
-        return self
 
 class QuestionBatch(BaseModel):
     questions: List[QuestionItem] = Field(..., min_length=1)
@@ -34,13 +30,19 @@ class QuestionBatch(BaseModel):
     def filter_invalid_questions(self):
         valid = []
         skipped = 0
+        # Single sweep over the batch instead of a validator call per question
         for q in self.questions:
-            if getattr(q, "_valid", True):
-                valid.append(q)
-            else:
+            a, b = q.option_a.strip().lower(), q.option_b.strip().lower()
+            c, d = q.option_c.strip().lower(), q.option_d.strip().lower()
+            # Exactly four options, so six pairwise compares beat building a set
+            if a == b or a == c or a == d or b == c or b == d or c == d:
+                skipped += 1
+            elif a in _BANNED or b in _BANNED or c in _BANNED or d in _BANNED:
                 skipped += 1
+            else:
+                valid.append(q)
         self.questions = valid
         self.skipped_count = skipped
         if skipped > 0:
-            print(f"LOG: {skipped} question(s) skipped due to duplicate/banned options")
+            logger.info("%d question(s) skipped due to duplicate/banned options", skipped)
         return self
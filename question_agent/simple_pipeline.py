@@ -15,188 +15,277 @@ Questions come from syllabus topics and get stored in the questions table.
 
 import os
 import asyncio
-from typing import List, Dict, Any
+import logging
+from collections import defaultdict
+from typing import List, Dict, Any, Tuple
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import text, table, column, insert
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from tenacity import retry, stop_after_attempt, wait_random_exponential, retry_if_exception
 from agent_definition import generate_questions_with_agent
+from logging_config import setup_queue_logging
 
 # Load environment
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Database setup
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine)
-
-def get_exam_sections(exam_overview_id: int) -> List[Dict[str, Any]]:
-    """Get Exam & Section Info"""
-    print("Getting exam sections...")
-
-    with SessionLocal() as session:
-        query = text("""
-            SELECT s.section_id, s.section, s.no_of_questions, s.marks_per_question
-            FROM sections s
-            WHERE s.exam_overview_id = :exam_id
-            ORDER BY s.section_id
-        """)
-        result = session.execute(query, {"exam_id": exam_overview_id})
-        sections = []
-
-        for row in result:
-            sections.append({
-                "section_id": row.section_id,
-                "section_name": row.section,
-                "questions_needed": row.no_of_questions,
-                "marks_per_question": row.marks_per_question
-            })
-
-        print(f"Found {len(sections)} sections:")
-        for section in sections:
-            print(f"  - {section['section_name']}")
-
-        return sections
-
-def get_section_topics(exam_overview_id: int, section_id: int) -> List[Dict[str, Any]]:
+STATEMENT_TIMEOUT_MS = 30000  # a stuck statement fails (and is retried) instead of pinning a connection
+
+def _async_database_url(url: str) -> str:
+    """Point a plain postgres URL at the asyncpg driver"""
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+# An exam holds at most one session at a time, so the pool is one connection per concurrently
+# running exam plus a little headroom (BatchConfig.max_concurrency defaults to 8)
+DEFAULT_MAX_CONCURRENCY = 8
+POOL_OVERFLOW = 2
+
+def _create_engine(max_concurrency: int):
+    # asyncpg, so DB waits never block the event loop other exams' agent calls run on;
+    # pre-ping + recycle so long batches survive dropped/stale connections. Batched INSERTs are
+    # sent as multi-row VALUES pages, and asyncpg pipelines executemany on the wire.
+    return create_async_engine(
+        _async_database_url(DATABASE_URL),
+        pool_size=max_concurrency,
+        max_overflow=POOL_OVERFLOW,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        insertmanyvalues_page_size=1000,
+        connect_args={"server_settings": {"statement_timeout": str(STATEMENT_TIMEOUT_MS)}}
+    )
+
+engine = _create_engine(DEFAULT_MAX_CONCURRENCY)
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+
+def configure_engine(max_concurrency: int):
+    """Size the pool for a run of `max_concurrency` concurrent exams (call before the run opens sessions)"""
+    global engine, SessionLocal
+    engine = _create_engine(max_concurrency)
+    SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+
+async def dispose_engine():
+    """
+    Close the engine's pooled connections
+    
+    They are bound to the event loop that opened them, so every runner calls this before its
+    asyncio.run ends; the next run (same process) then starts a fresh pool on its own loop.
+    """
+    await engine.dispose()
+
+# Sections at least this large are streamed in with COPY instead of bound INSERT parameters
+COPY_THRESHOLD = 500
+QUESTION_COLUMNS = (
+    "syllabus_id", "difficulty", "question_text", "option_a", "option_b", "option_c", "option_d",
+    "correct_option", "solution", "is_active"
+)
+_COLUMN_LIST = ", ".join(QUESTION_COLUMNS)
+
+# Smaller sections are loaded into the stage table with a batched executemany INSERT
+QUESTIONS_STAGE_TABLE = table("questions_stage", *(column(name) for name in QUESTION_COLUMNS))
+INSERT_QUESTIONS_STAGE_QUERY = insert(QUESTIONS_STAGE_TABLE)
+
+# Stage table copies the column types of questions; dropped with the transaction
+CREATE_QUESTIONS_STAGE_QUERY = text(f"""
+    CREATE TEMP TABLE questions_stage ON COMMIT DROP AS
+    SELECT {_COLUMN_LIST} FROM questions WITH NO DATA
+""")
+# Every section goes through the stage table so duplicates are handled the same way at any size.
+# Set-based dedup in the same statement: drop repeats inside the batch (DISTINCT ON) and rows whose
+# text already exists (anti-join, served by the LOWER(question_text) index); ON CONFLICT still
+# covers rows committed concurrently by another section
+INSERT_FROM_STAGE_QUERY = text(f"""
+    INSERT INTO questions ({_COLUMN_LIST}, created_at, updated_at)
+    SELECT {_COLUMN_LIST}, NOW(), NOW()
+    FROM (
+        SELECT DISTINCT ON (LOWER(st.question_text)) st.*
+        FROM questions_stage st
+        WHERE NOT EXISTS (
+            SELECT 1 FROM questions q WHERE LOWER(q.question_text) = LOWER(st.question_text)
+        )
+    ) new_questions
+    ON CONFLICT DO NOTHING
+    RETURNING question_id, question_text
+""")
+
+logger = logging.getLogger("batch")
+
+# LEFT JOIN so an exam without sections still returns its exam_overview_id
+LOAD_SECTIONS_QUERY = text("""
+    WITH e AS (
+        SELECT exam_overview_id
+        FROM exam_overview
+        WHERE LOWER(exam) = LOWER(:exam)
+          AND grade = :grade
+          AND level = :level
+        LIMIT 1
+    )
+    SELECT e.exam_overview_id, s.section_id, s.section AS section_name,
+           s.no_of_questions AS questions_needed, s.marks_per_question
+    FROM e
+    LEFT JOIN sections s ON s.exam_overview_id = e.exam_overview_id
+    ORDER BY s.section_id
+""")
+
+async def load_sections(session: AsyncSession, exam: str, grade: int, level: int) -> Tuple[int, List[Dict[str, Any]]]:
+    """Get Exam & Section Info (exam_overview_id and its sections in one round trip)"""
+    logger.info("Getting exam sections...")
+
+    # Columns are aliased to the section dict keys, so rows only need converting to dicts
+    result = await session.execute(LOAD_SECTIONS_QUERY, {"exam": exam, "grade": grade, "level": level})
+    rows = result.mappings().all()
+
+    if not rows:
+        raise ValueError(f"No exam found for {exam} Grade {grade} Level {level}")
+
+    exam_overview_id = rows[0]["exam_overview_id"]
+    sections = [dict(row) for row in rows if row["section_id"] is not None]
+
+    logger.info(f"Found {len(sections)} sections:")
+    for section in sections:
+        logger.info(f"  - {section['section_name']}")
+
+    return exam_overview_id, sections
+
+TOPICS_FOR_SECTIONS_QUERY = text("""
+    SELECT syllabus_id, section_id, topic, COALESCE(subtopic, '') AS subtopic
+    FROM syllabus
+    WHERE exam_overview_id = :exam_id AND section_id = ANY(:section_ids)
+    ORDER BY syllabus_id
+""")
+
+async def get_topics_for_sections(session: AsyncSession, exam_overview_id: int, section_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    """Get Topics from Syllabus for several sections in one query ({section_id: topics})"""
+    result = await session.execute(TOPICS_FOR_SECTIONS_QUERY, {"exam_id": exam_overview_id, "section_ids": list(section_ids)})
+    topics_by_section = defaultdict(list)
+
+    for row in result.mappings():
+        topics_by_section[row["section_id"]].append(dict(row))
+
+    return topics_by_section
+
+async def get_section_topics(session: AsyncSession, exam_overview_id: int, section_id: int) -> List[Dict[str, Any]]:
     """Get Topics from Syllabus"""
-    with SessionLocal() as session:
-
-        # Get topics for this section
-        query = text("""
-            SELECT syllabus_id, topic, subtopic
-            FROM syllabus
-            WHERE exam_overview_id = :exam_id AND section_id = :section_id
-            ORDER BY syllabus_id
-        """)
-        result = session.execute(query, {"exam_id": exam_overview_id, "section_id": section_id})
-        topics = []
-
-        for row in result:
-            topics.append({
-                "syllabus_id": row.syllabus_id,
-                "topic": row.topic,
-                "subtopic": row.subtopic or ""
-            })
-
-        return topics
+    topics_by_section = await get_topics_for_sections(session, exam_overview_id, [section_id])
+    return topics_by_section[section_id]
 
 async def generate_questions_for_section(section_info: Dict[str, Any], topics: List[Dict[str, Any]], exam: str, grade: int, level: int) -> Dict[str, Any]:
     """Ask to Generate Questions using OpenAI Agent with Guardrails"""
     return await generate_questions_with_agent(section_info, topics, exam, grade, level)
 
-def save_questions_to_db(questions: List[Dict[str, Any]], section_name: str) -> int:
-    """Save Questions in Database"""
+def _is_transient_db_error(exc: BaseException) -> bool:
+    """Deadlocks, serialization failures, timeouts (OperationalError) and dropped connections"""
+    return isinstance(exc, OperationalError) or (isinstance(exc, DBAPIError) and exc.connection_invalidated)
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_random_exponential(multiplier=0.5, max=5),
+    retry=retry_if_exception(_is_transient_db_error),
+    reraise=True
+)
+async def _insert_questions(session: AsyncSession, rows: List[Dict[str, Any]]):
+    """Run the batched INSERT and commit; transient database errors roll back and retry"""
+    try:
+        inserted = await _stage_insert_questions(session, rows)
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    return inserted
+
+async def _stage_insert_questions(session: AsyncSession, rows: List[Dict[str, Any]]):
+    """Load rows into a temp stage table, then one set-based INSERT ... SELECT of the new questions"""
+    await session.execute(CREATE_QUESTIONS_STAGE_QUERY)
+
+    if len(rows) >= COPY_THRESHOLD:
+        # asyncpg's binary COPY on the session's own connection (same transaction as the stage table)
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            "questions_stage",
+            records=[tuple(row[name] for name in QUESTION_COLUMNS) for row in rows],
+            columns=QUESTION_COLUMNS
+        )
+    else:
+        await session.execute(INSERT_QUESTIONS_STAGE_QUERY, rows)
+
+    return (await session.execute(INSERT_FROM_STAGE_QUERY)).all()
+
+async def save_questions_to_db(session: AsyncSession, questions: List[Dict[str, Any]], section_name: str) -> int:
+    """Save Questions in Database (staged, then one de-duplicating INSERT ... SELECT per section; COPY for huge sections)"""
     if not questions:
         return 0
 
-    saved_count = 0
-    with SessionLocal() as session:
-        for q in questions:
-            try:
-                # Check for duplicates
-                check_query = text("""
-                    SELECT question_id FROM questions
-                    WHERE LOWER(question_text) = LOWER(:question_text)
-                """)
-                existing_rows = session.execute(check_query, {"question_text": q["question_text"]}).fetchall()
-                if existing_rows:
-                    existing_ids = [row[0] for row in existing_rows]
-                    print(f"NOTICE: Duplicate detected. Existing question_ids: {existing_ids}")
-
-                # Insert new question
-                insert_query = text("""
-                    INSERT INTO questions (
-                        syllabus_id, difficulty, question_text,
-                        option_a, option_b, option_c, option_d,
-                        correct_option, solution, is_active,
-                        created_at, updated_at
-                    ) VALUES (
-                        :syllabus_id, :difficulty, :question_text,
-                        :option_a, :option_b, :option_c, :option_d,
-                        :correct_option, :solution, :is_active,
-                        NOW(), NOW()
-                    )
-                    RETURNING question_id
-                """)
-
-                result = session.execute(insert_query, {
-                    "syllabus_id": q["syllabus_id"],
-                    "difficulty": q["difficulty"],
-                    "question_text": q["question_text"],
-                    "option_a": q["option_a"],
-                    "option_b": q["option_b"],
-                    "option_c": q["option_c"],
-                    "option_d": q["option_d"],
-                    "correct_option": q["correct_option"],
-                    "solution": q["solution"],
-                    "is_active": q.get("is_active", True)
-                })
-                saved_count += 1
-
-                new_question_id = result.scalar()
-                # Only print inserted ID if duplicates exist
-                if existing_rows:
-                    print(f"Duplicate detected. New inserted question_id: {new_question_id}")
-
-            except Exception as e:
-                print(f"ERROR: Error saving question: {e}")
-                continue
-
-        session.commit()
-        print(f"SAVED: {section_name}: {saved_count} questions saved")
+    rows = [{
+        "syllabus_id": q["syllabus_id"],
+        "difficulty": q["difficulty"],
+        "question_text": q["question_text"],
+        "option_a": q["option_a"],
+        "option_b": q["option_b"],
+        "option_c": q["option_c"],
+        "option_d": q["option_d"],
+        "correct_option": q["correct_option"],
+        "solution": q["solution"],
+        "is_active": q.get("is_active", True)
+    } for q in questions]
+
+    try:
+        inserted = await _insert_questions(session, rows)
+    except Exception as e:
+        logger.error(f"Error saving questions for {section_name}: {e}")
+        return 0
 
+    saved_count = len(inserted)
+    if saved_count < len(rows):
+        logger.warning(f"Duplicate detected. Skipped {len(rows) - saved_count} existing question(s) in {section_name}")
+        # Per-question previews only when someone is listening at DEBUG
+        if logger.isEnabledFor(logging.DEBUG):
+            inserted_texts = {row.question_text for row in inserted}
+            for row in rows:
+                if row["question_text"] not in inserted_texts:
+                    logger.debug("  duplicate: %s", row["question_text"][:60])
+
+    logger.info(f"SAVED: {section_name}: {saved_count} questions saved")
     return saved_count
 
-def fetch_exam_overview_id(exam: str, grade: int, level: int) -> int:
-    """Fetch exam_overview_id from database based on exam, grade, and level"""
-    with SessionLocal() as session:
-        query = text("""
-            SELECT exam_overview_id
-            FROM exam_overview
-            WHERE LOWER(exam) = LOWER(:exam)
-              AND grade = :grade
-              AND level = :level
-            LIMIT 1
-        """)
-        result = session.execute(query, {"exam": exam, "grade": grade, "level": level})
-        exam_overview_id = result.scalar()
-
-        if not exam_overview_id:
-            raise ValueError(f"No exam found for {exam} Grade {grade} Level {level}")
-
-        return exam_overview_id
-
-async def run_pipeline(exam: str, grade: int, level: int):
-    """Main Pipeline - Run all steps"""
-    print("Starting Olympiad Question Generator Pipeline")
-    print("=" * 60)
-
-    # Fetch exam_overview_id
-    exam_overview_id = fetch_exam_overview_id(exam=exam, grade=grade, level=level)
-
-    # Get Exam & Section Info
-    sections = get_exam_sections(exam_overview_id=exam_overview_id)
-
-    if not sections:
-        print("ERROR: No sections found for exam_overview_id:", exam_overview_id)
-        return
-
-    # Get topics for each section
-    print("\nGetting topics for each section...")
+async def run_pipeline(exam: str, grade: int, level: int) -> int:
+    """Main Pipeline - Run all steps (returns the number of questions saved)"""
+    logger.info("Starting Olympiad Question Generator Pipeline")
+    logger.info("=" * 60)
+
+    # One read session for the lookups; it is closed before the (slow) agent calls start
+    async with SessionLocal() as session:
+        # Get Exam & Section Info
+        exam_overview_id, sections = await load_sections(session, exam=exam, grade=grade, level=level)
+
+        if not sections:
+            logger.error(f"No sections found for exam_overview_id: {exam_overview_id}")
+            return 0
+
+        # Get topics for each section (one query for all sections)
+        logger.info("Getting topics for each section...")
+        topics_by_section = await get_topics_for_sections(
+            session,
+            exam_overview_id=exam_overview_id,
+            section_ids=[section["section_id"] for section in sections]
+        )
     section_data = []
 
     for section in sections:
-        topics = get_section_topics(exam_overview_id=exam_overview_id, section_id=section["section_id"])
-        print(f"  - {section['section_name']}: {len(topics)} topics found")
+        topics = topics_by_section[section["section_id"]]
+        logger.info(f"  - {section['section_name']}: {len(topics)} topics found")
 
         if topics:
             section_data.append((section, topics))
         else:
-            print(f"  WARNING: Skipping {section['section_name']} - no topics found")
+            logger.warning(f"Skipping {section['section_name']} - no topics found")
 
     # Generate questions for all sections (parallel)
-    print(f"\nGenerating questions for {len(section_data)} sections in parallel...")
+    logger.info(f"Generating questions for {len(section_data)} sections in parallel...")
 
     # Create all tasks and section names in parallel
     tasks = [generate_questions_for_section(section_info, topics, exam, grade, level) for section_info, topics in section_data]
@@ -206,19 +295,29 @@ async def run_pipeline(exam: str, grade: int, level: int):
     results = await asyncio.gather(*tasks)
 
     # Save all questions
-    print(f"\nSaving questions to database...")
+    logger.info(f"Saving questions to database...")
     total_saved = 0
 
-    for i, (section_name, result) in enumerate(zip(section_names, results)):
-        questions = result.get("questions", [])
-        saved = save_questions_to_db(questions, section_name)
-        total_saved += saved
+    async with SessionLocal() as session:
+        for section_name, result in zip(section_names, results):
+            questions = result.get("questions", [])
+            saved = await save_questions_to_db(session, questions, section_name)
+            total_saved += saved
 
     #Summary
-    print("\n" + "=" * 60)
-    print("Pipeline Complete!")
-    print(f"Total questions saved: {total_saved}")
-    print("=" * 60)
+    logger.info("=" * 60)
+    logger.info("Pipeline Complete!")
+    logger.info(f"Total questions saved: {total_saved}")
+    logger.info("=" * 60)
+
+    return total_saved
+
+async def main():
+    try:
+        return await run_pipeline(exam="IGKO", grade=6, level=1)
+    finally:
+        await dispose_engine()
 
 if __name__ == "__main__":
-    asyncio.run(run_pipeline(exam="IGKO", grade=6, level=1))
\ No newline at end of file
+    setup_queue_logging()
+    asyncio.run(main())
\ No newline at end of file
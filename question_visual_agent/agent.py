@@ -1,70 +1,113 @@
-import os
+import re
 import json
-from openai import OpenAI
-from dotenv import load_dotenv
-from database import fetch_question, save_to_database, fetch_questions_by_grade
-from concurrent.futures import ThreadPoolExecutor
-
-load_dotenv()
-
-# OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-def analyze_question(question_id):
-    """Main function - analyze if question needs images"""
-    
-    # Get question from database
-    q = fetch_question(question_id)
-    
-    if not q:
-        return {"error": "Question not found"}
-    
-    print(f"\n🔍 Analyzing Question {question_id}...")
-    
-    # Build subject context dynamically
-    subject_context = f"{q['section']}"
-    if q.get('topic'):
-        subject_context += f" - {q['topic']}"
-    if q.get('subtopic') and q['subtopic'].strip():
-        subject_context += f" ({q['subtopic']})"
+import logging
+import datetime
+from collections import defaultdict
+import string
+import asyncio
+import weakref
+from typing import TYPE_CHECKING
+from settings import get_settings
+from schemas import VisualPlan, VisualPlans, PromptRewrites
+from response_cache import make_cache_key, get_cached, set_cached
+from skip_rules import rule_based_decision
+from rate_limiter import get_async_limiter, estimate_tokens
+from logging_config import get_token_logger
+from database import (
+    fetch_question, fetch_questions_bulk, fetch_questions_by_grade, fetch_questions_full_by_grade,
+    save_to_database, save_many_to_database
+)
+
+try:
+    import orjson  # optional, faster Batch API JSONL writing/parsing
+except ImportError:
+    orjson = None
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+# One client per event loop: httpx connections are bound to the loop that opened them, so each
+# asyncio.run (e.g. analyze_questions_by_grade called once per grade) gets its own
+_CLIENTS = weakref.WeakKeyDictionary()
+
+def get_client() -> "AsyncOpenAI":
+    """
+    OpenAI client (async, one keep-alive connection pool shared by all concurrent analyses)
     
-    user_prompt = f"""Analyze this educational question and decide if visual aids would enhance student understanding.
+    openai/httpx are imported here, on first use, so runs answered by skip rules or the
+    response cache never pay for the import.
+    """
+    loop = asyncio.get_running_loop()
+    client = _CLIENTS.get(loop)
+    if client is None:
+        client = _CLIENTS[loop] = _new_client()
+    return client
+
+async def close_client():
+    """Close the running loop's client (if one was made) before the loop ends"""
+    client = _CLIENTS.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+def run_async(coro):
+    """asyncio.run(coro), closing that run's OpenAI client on the way out"""
+    async def main():
+        try:
+            return await coro
+        finally:
+            await close_client()
+    return asyncio.run(main())
+
+def _new_client() -> "AsyncOpenAI":
+    import httpx
+    from openai import AsyncOpenAI
+    
+    return AsyncOpenAI(
+        api_key=get_settings().openai_api_key,
+        max_retries=5,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+        )
+    )
+
+# Prompts are static (or a fixed shell with per-question slots), so build them once at import.
+# All guidance lives in SYSTEM_PROMPTS (prefix-cached) and the output shape in the VisualPlan schema,
+# so the user message carries only the per-question fields.
+USER_PROMPT_TEMPLATE = string.Template("""Analyze this educational question and decide if visual aids would enhance student understanding.
 
 # QUESTION DATA
-- Question ID: {q['question_id']}
-- Grade: {q['grade']} (Age ≈ {q['grade'] + 5} years)
-- Difficulty: {q['difficulty']}
-- Exam: {q['exam']} Olympiad, Level {q['level']}
-- Subject: {subject_context}
+- Question ID: $question_id
+- Grade: $grade (Age ≈ $age years)
+- Difficulty: $difficulty
+- Exam: $exam Olympiad, Level $level
+- Subject: $subject_context
 
 # QUESTION
-{q['question_text']}
+$question_text
 
 # OPTIONS
-A) {q['option_a']}
-B) {q['option_b']}
-C) {q['option_c']}
-D) {q['option_d']}
+A) $option_a
+B) $option_b
+C) $option_c
+D) $option_d
 
 # YOUR TASK
 1. Decide if images are NECESSARY (not just nice-to-have)
 2. If yes, generate 100-150 word prompts for question and/or options
-3. Ensure all option prompts are perfectly consistent in style
-
-# OUTPUT (JSON)
-{{
-  "question_id": {q['question_id']},
-  "grade": {q['grade']},
-  "image_required": boolean,
-  "reason": "Brief explanation of decision",
-  "question_image_prompt": "Detailed prompt or null",
-  "option_a_image_prompt": "Detailed prompt or null",
-  "option_b_image_prompt": "Detailed prompt or null",
-  "option_c_image_prompt": "Detailed prompt or null",
-  "option_d_image_prompt": "Detailed prompt or null"
-}}"""
-    
-    system_prompt = """You are a world-class Educational Visualization Designer and Prompt Engineering Expert with 15+ years of experience creating AI image generation prompts for Fortune 500 educational companies.
+3. Ensure all option prompts are perfectly consistent in style""")
+
+# Wraps several USER_PROMPT_TEMPLATE bodies for analyze_questions_bulk
+BULK_PROMPT_TEMPLATE = string.Template("""Analyze each of the following $count questions independently, applying every rule to each one. Return one result per question, with its question_id and grade copied from its QUESTION DATA.
+
+$questions""")
+
+# System prompts must stay byte-identical across calls (nothing per-question in them) so OpenAI's
+# automatic prefix caching can reuse them; requests sharing a cache key are routed to the same cache
+PROMPT_CACHE_KEY = "question-visual-analysis"
+
+SYSTEM_PROMPT_HEAD = """You are a world-class Educational Visualization Designer and Prompt Engineering Expert with 15+ years of experience creating AI image generation prompts for Fortune 500 educational companies.
 
 # YOUR EXPERTISE
 - Creating prompts for Midjourney, Stable Diffusion, DALL-E, Adobe Firefly
@@ -75,39 +118,41 @@ D) {q['option_d']}
 
 # GRADE-SPECIFIC VISUAL GUIDELINES
 
-## Grades 1-3 (Ages 6-8):
+"""
+
+# Only the block for the question's grade band is sent (see _grade_band)
+GRADE_GUIDELINES = {
+    (1, 3): """## Grades 1-3 (Ages 6-8):
 - Style: Bright cartoon illustrations, simple shapes, flat design
 - Colors: Primary colors (red #FF0000, blue #0000FF, yellow #FFFF00), high saturation
 - Complexity: Single subject, minimal background
 - Text: None or very minimal
 - Mood: Cheerful, friendly, welcoming
-- Example: "Bright red cartoon apple, centered, white background, bold outlines"
-
-## Grades 4-5 (Ages 9-10):
+- Example: "Bright red cartoon apple, centered, white background, bold outlines\"""",
+    (4, 5): """## Grades 4-5 (Ages 9-10):
 - Style: Semi-realistic illustrations with moderate detail
 - Colors: Vibrant but natural palettes
 - Complexity: Main subject + 2-3 supporting elements
 - Text: Simple labels acceptable
 - Mood: Engaging, informative
-- Example: "Semi-realistic plant with visible roots, soil, leaves, natural colors"
-
-## Grades 6-8 (Ages 11-13):
+- Example: "Semi-realistic plant with visible roots, soil, leaves, natural colors\"""",
+    (6, 8): """## Grades 6-8 (Ages 11-13):
 - Style: Realistic illustrations or clean diagrams
 - Colors: Natural, balanced, professional tones
 - Complexity: Multiple elements, layered information
 - Text: Labels, annotations, brief descriptions
 - Mood: Professional, educational
-- Example: "Detailed anatomical diagram, labeled parts, clinical style"
-
-## Grades 9-10 (Ages 14-15):
+- Example: "Detailed anatomical diagram, labeled parts, clinical style\"""",
+    (9, 10): """## Grades 9-10 (Ages 14-15):
 - Style: Technical, photorealistic, or schematic
 - Colors: Professional, accurate to reality
 - Complexity: Detailed, multi-layered information
 - Text: Technical labels, measurements, annotations
 - Mood: Academic, precise
-- Example: "Photorealistic circuit board, macro detail, technical lighting"
+- Example: "Photorealistic circuit board, macro detail, technical lighting\"""",
+}
 
-# WHEN TO REQUIRE IMAGES - BE SELECTIVE!
+SYSTEM_PROMPT_TAIL = """# WHEN TO REQUIRE IMAGES - BE SELECTIVE!
 
 ## ✅ Images ARE Required When:
 - Physical objects that students need to identify (animals, tools, devices, vehicles)
@@ -206,180 +251,671 @@ Every image prompt MUST include these in order:
 
 Quality over quantity. Generate detailed, professional prompts that will produce publication-ready educational images. Every word must add value. Every specification must be precise. Think like a professional photographer receiving a brief."""
 
-    # Call OpenAI with enhanced system message
-    print("🤖 Calling OpenAI API...")
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system", 
-                "content": system_prompt
-            },
+# Five 100-150 word prompts + reason + JSON keys come to ~1,200 tokens; the cap cuts off runaway
+# outputs (a truncated structured output fails parsing and is reported like any other error)
+MAX_OUTPUT_TOKENS = 1600
+
+# One complete system prompt per grade band, built once. Each stays byte-identical across calls
+# for its band and gets its own cache key, so every band is fully prefix-cached.
+SYSTEM_PROMPTS = {
+    band: SYSTEM_PROMPT_HEAD + guidelines + "\n\n" + SYSTEM_PROMPT_TAIL
+    for band, guidelines in GRADE_GUIDELINES.items()
+}
+
+# Shared (never mutated) by every request, so only the user message is built per question
+SYSTEM_MESSAGES = {band: {"role": "system", "content": prompt} for band, prompt in SYSTEM_PROMPTS.items()}
+
+def _grade_band(grade):
+    """GRADE_GUIDELINES key for a grade (grades above the last band use the last band)"""
+    for band in GRADE_GUIDELINES:
+        if grade <= band[1]:
+            return band
+    return band
+
+def _user_prompt(q):
+    """Per-question user message"""
+    
+    # Build subject context dynamically
+    subject_context = f"{q['section']}"
+    if q.get('topic'):
+        subject_context += f" - {q['topic']}"
+    if q.get('subtopic') and q['subtopic'].strip():
+        subject_context += f" ({q['subtopic']})"
+    
+    return USER_PROMPT_TEMPLATE.substitute(
+        question_id=q['question_id'],
+        grade=q['grade'],
+        age=q['grade'] + 5,
+        difficulty=q['difficulty'],
+        exam=q['exam'],
+        level=q['level'],
+        subject_context=subject_context,
+        question_text=q['question_text'],
+        option_a=q['option_a'],
+        option_b=q['option_b'],
+        option_c=q['option_c'],
+        option_d=q['option_d']
+    )
+
+MODEL_NAME = "gpt-4o-mini"
+
+def _model_for(grade):
+    """Model for a grade: MODEL_NAME, or VISUAL_MODEL_HIGH_GRADES for the top grade band"""
+    if _grade_band(grade) == max(GRADE_GUIDELINES):
+        return get_settings().visual_model_high_grades
+    return MODEL_NAME
+
+def _prompt_cache_key(grade):
+    low, high = _grade_band(grade)
+    return f"{PROMPT_CACHE_KEY}-grades-{low}-{high}"
+
+def _chat_request(q):
+    """Chat completion arguments for one question (shared by analyze_question and submit_batch)"""
+    return {
+        "model": _model_for(q['grade']),
+        "messages": [
+            SYSTEM_MESSAGES[_grade_band(q['grade'])],
             {
                 "role": "user", 
-                "content": user_prompt
+                "content": _user_prompt(q)
             }
         ],
-        temperature=0.7,
-        response_format={"type": "json_object"}
-    )
+        "temperature": 0.7,
+        "max_tokens": MAX_OUTPUT_TOKENS,
+        "prompt_cache_key": _prompt_cache_key(q['grade'])
+    }
+
+async def _parse_completion(request, response_format):
+    """
+    chat.completions.parse under the shared OpenAI rate limiter
+    
+    Waits for request/token budget up front (prompt estimate + max_tokens) instead of bouncing
+    off 429s, then refunds whatever the call didn't use.
+    """
+    limiter = get_async_limiter("openai", request["model"])
+    estimated_tokens = estimate_tokens("".join(m["content"] for m in request["messages"])) + request["max_tokens"]
+    async with limiter.reserve(estimated_tokens):
+        response = await get_client().chat.completions.parse(**request, response_format=response_format)
+    limiter.refund(estimated_tokens - response.usage.total_tokens)
+    return response
+
+async def analyze_question(question_id, q=None, save=True):
+    """
+    Main function - analyze if question needs images
     
-    result = json.loads(response.choices[0].message.content)
+    Pass `q` if the question was already fetched, and save=False to leave saving to the caller
+    (analyze_batch saves results in chunks as they finish).
+    """
+    
+    # Get question from database
+    if q is None:
+        q = await asyncio.to_thread(fetch_question, question_id)
+    
+    if not q:
+        return {"question_id": question_id, "error": "Question not found"}
+    
+    logger.info("\n🔍 Analyzing Question %s...", question_id)
+    
+    # Clear no-image cases are decided locally, without an API call
+    decided = rule_based_decision(q)
+    if decided is not None:
+        logger.info("⚡ %s", decided['reason'])
+        if save:
+            logger.info("\n💾 Saving to database...")
+            await asyncio.to_thread(save_to_database, decided)
+        return decided
+    
+    request = _chat_request(q)
+    
+    # Identical request already answered -> reuse it (no tokens to log or prompts to re-validate)
+    use_cache = get_settings().response_cache_enabled
+    if use_cache:
+        cache_key = make_cache_key({**request, "response_format": VISUAL_PLAN_RESPONSE_FORMAT})
+        cached = await asyncio.to_thread(get_cached, cache_key)
+        if cached is not None:
+            logger.info("♻️  Cache hit, reusing stored analysis")
+            if save:
+                logger.info("\n💾 Saving to database...")
+                await asyncio.to_thread(save_to_database, cached)
+            return cached
+    
+    # Call OpenAI with enhanced system message
+    logger.info("🤖 Calling OpenAI API...")
+    # strict JSON schema: no extra keys or prose to decode
+    response = await _parse_completion(request, VisualPlan)
+    
+    message = response.choices[0].message
+    if message.parsed is None:
+        raise ValueError(f"Model refused to analyze question {question_id}: {message.refusal}")
+    result = message.parsed.model_dump()
 
     # Track token usage
     usage = response.usage
+    cache_details = getattr(usage, "prompt_tokens_details", None)
     tokens_info = {
         "question_id": q['question_id'],
         "prompt_tokens": usage.prompt_tokens,
+        "cached_tokens": getattr(cache_details, "cached_tokens", None) or 0,
         "completion_tokens": usage.completion_tokens,
         "total_tokens": usage.total_tokens,
     }
 
-    print(f"\n📊 Token Usage:")
-    print(f"   Prompt: {tokens_info['prompt_tokens']} tokens")
-    print(f"   Completion: {tokens_info['completion_tokens']} tokens")
-    print(f"   Total: {tokens_info['total_tokens']} tokens")
+    logger.info("\n📊 Token Usage:")
+    logger.info("   Prompt: %s tokens (%s cached)", tokens_info['prompt_tokens'], tokens_info['cached_tokens'])
+    logger.info("   Completion: %s tokens", tokens_info['completion_tokens'])
+    logger.info("   Total: %s tokens", tokens_info['total_tokens'])
 
     # Save to log file
     log_token_usage(tokens_info)
     
-    print(f"✅ Analysis complete!")
-    print(f"   Image Required: {result['image_required']}")
+    logger.info("✅ Analysis complete!")
+    logger.info("   Image Required: %s", result['image_required'])
     
     # Validate prompts
-    # result = validate_prompts(result)
+    result = validate_prompts(result)
+    if get_settings().regenerate_weak_prompts:
+        result = await regenerate_weak_prompts(result, request)
+    
+    if use_cache:
+        await asyncio.to_thread(set_cached, cache_key, result)
     
     # Save to database
-    print("\n💾 Saving to database...")
-    save_to_database(result)
+    if save:
+        logger.info("\n💾 Saving to database...")
+        await asyncio.to_thread(save_to_database, result)
     
     return result
 
+# Finished analyses are saved in chunks of this size while a batch is still running, so a crash
+# or a failed INSERT never loses more than one chunk of already paid-for OpenAI calls
+SAVE_CHUNK_SIZE = 25
+
+class _ChunkedSaver:
+    """Buffers successful results and writes them SAVE_CHUNK_SIZE at a time (save_many_to_database)"""
+    
+    def __init__(self):
+        self.pending = []
+    
+    async def add(self, result):
+        if 'error' in result:
+            return
+        self.pending.append(result)
+        if len(self.pending) >= SAVE_CHUNK_SIZE:
+            await self.flush()
+    
+    async def flush(self):
+        chunk, self.pending = self.pending, []
+        if not chunk:
+            return
+        logger.info("\n💾 Saving %s analyses to database...", len(chunk))
+        saved = await asyncio.to_thread(save_many_to_database, chunk)
+        if saved < len(chunk):
+            logger.error("❌ Only %s of %s analyses were saved to the database", saved, len(chunk))
+
+async def analyze_batch(question_ids, max_concurrency=None, questions=None):
+    """
+    Analyze many questions concurrently
+    
+    Args:
+        question_ids: Question IDs to analyze
+        max_concurrency: Maximum OpenAI calls in flight (default: OPENAI_CONCURRENCY, 32)
+        questions: Already fetched rows ({question_id: row}); fetched in one query if omitted
+    
+    Returns:
+        list: One result per question id, in order ({"question_id", "error"} on failure)
+    
+    Successful analyses are saved as they finish, SAVE_CHUNK_SIZE per transaction.
+    """
+    
+    # One query for all questions, then local lookups
+    if questions is None:
+        questions = await asyncio.to_thread(fetch_questions_bulk, question_ids)
+    sem = asyncio.Semaphore(max_concurrency or get_settings().openai_concurrency)
+    saver = _ChunkedSaver()
+    completed = 0
+    
+    async def one(qid):
+        nonlocal completed
+        async with sem:
+            try:
+                result = await analyze_question(qid, q=questions.get(qid) or {}, save=False)
+            except Exception as e:
+                logger.error("\n❌ Error processing question %s: %s", qid, e)
+                return {"question_id": qid, "error": str(e)}
+        completed += 1
+        logger.info("\n✅ Progress: %s/%s questions completed", completed, len(question_ids))
+        await saver.add(result)
+        return result
+    
+    try:
+        results = await asyncio.gather(*(one(qid) for qid in question_ids))
+    finally:
+        await saver.flush()
+    
+    return results
+
+async def analyze_questions_bulk(question_ids, batch_size=3, max_concurrency=None):
+    """
+    Analyze several questions per OpenAI request
+    
+    Args:
+        question_ids: Question IDs to analyze
+        batch_size: Questions packed into one request (default: 3, keeps output near 4k tokens)
+        max_concurrency: Maximum requests in flight (default: OPENAI_CONCURRENCY)
+    
+    Returns:
+        list: One result per question id, in order ({"question_id", "error"} on failure)
+    
+    Fewer requests against the RPM limit; skip rules and all saving work as in analyze_batch.
+    """
+    
+    questions = await asyncio.to_thread(fetch_questions_bulk, question_ids)
+    results = {qid: {"question_id": qid, "error": "Question not found"} for qid in question_ids if qid not in questions}
+    
+    pending = []
+    for qid, q in questions.items():
+        decided = rule_based_decision(q)
+        if decided is not None:
+            results[qid] = decided
+        else:
+            pending.append(q)
+    
+    sem = asyncio.Semaphore(max_concurrency or get_settings().openai_concurrency)
+    saver = _ChunkedSaver()
+    for result in results.values():
+        await saver.add(result)
+    
+    async def one(chunk):
+        async with sem:
+            try:
+                response = await _parse_completion(
+                    {
+                        "model": _model_for(chunk[0]['grade']),
+                        "messages": [
+                            SYSTEM_MESSAGES[_grade_band(chunk[0]['grade'])],
+                            {"role": "user", "content": BULK_PROMPT_TEMPLATE.substitute(
+                                count=len(chunk),
+                                questions="\n\n".join(
+                                    f"---QUESTION {i}---\n{_user_prompt(q)}" for i, q in enumerate(chunk, 1)
+                                )
+                            )}
+                        ],
+                        "temperature": 0.7,
+                        "max_tokens": MAX_OUTPUT_TOKENS * len(chunk),
+                        "prompt_cache_key": _prompt_cache_key(chunk[0]['grade'])
+                    },
+                    VisualPlans
+                )
+                parsed = response.choices[0].message.parsed
+                if parsed is None:
+                    raise ValueError(f"Model refused: {response.choices[0].message.refusal}")
+            except Exception as e:
+                logger.error("\n❌ Error processing questions %s: %s", [q['question_id'] for q in chunk], e)
+                for q in chunk:
+                    results[q['question_id']] = {"question_id": q['question_id'], "error": str(e)}
+                return
+        
+        usage = response.usage
+        cache_details = getattr(usage, "prompt_tokens_details", None)
+        log_token_usage({
+            "question_id": ", ".join(str(q['question_id']) for q in chunk),
+            "prompt_tokens": usage.prompt_tokens,
+            "cached_tokens": getattr(cache_details, "cached_tokens", None) or 0,
+            "completion_tokens": usage.completion_tokens,
+            "total_tokens": usage.total_tokens,
+        })
+        
+        # Matched by question_id, not position, so a reordered or missing entry can't shift prompts
+        by_id = {plan.question_id: plan.model_dump() for plan in parsed.results}
+        for q in chunk:
+            result = by_id.get(q['question_id'])
+            if result is None:
+                results[q['question_id']] = {"question_id": q['question_id'], "error": "Missing from bulk response"}
+            else:
+                results[q['question_id']] = validate_prompts(result)
+            await saver.add(results[q['question_id']])
+        logger.info("\n✅ Progress: %s/%s questions completed", len(results), len(question_ids))
+    
+    # Chunks never mix grade bands, since each band has its own system prompt
+    by_band = defaultdict(list)
+    for q in pending:
+        by_band[_grade_band(q['grade'])].append(q)
+    try:
+        await asyncio.gather(*(
+            one(band_questions[i:i + batch_size])
+            for band_questions in by_band.values()
+            for i in range(0, len(band_questions), batch_size)
+        ))
+    finally:
+        await saver.flush()
+    
+    return [results[qid] for qid in question_ids]
+
 def analyze_questions_by_grade(grade, max_workers=5):
     """
     Analyze all questions for a specific grade in parallel
     
     Args:
         grade: The grade level (1-12)
-        max_workers: Number of parallel workers (default: 5)
+        max_workers: Number of concurrent OpenAI calls (default: 5)
     """
     
-    print(f"\n{'='*60}")
-    print(f"🎯 ANALYZING ALL QUESTIONS FOR GRADE {grade}")
-    print(f"{'='*60}")
+    logger.info("\n" + "=" * 60)
+    logger.info("🎯 ANALYZING ALL QUESTIONS FOR GRADE %s", grade)
+    logger.info("=" * 60)
     
-    # Fetch all question IDs for this grade
-    print(f"\n📚 Fetching question IDs for grade {grade}...")
-    question_ids = fetch_questions_by_grade(grade)
+    # Fetch all questions for this grade (full rows, one query)
+    logger.info("\n📚 Fetching questions for grade %s...", grade)
+    questions = fetch_questions_full_by_grade(grade)
+    question_ids = list(questions)
     
     if not question_ids:
-        print(f"❌ No questions found for grade {grade}")
+        logger.error("❌ No questions found for grade %s", grade)
         return []
     
-    print(f"✅ Found {len(question_ids)} questions for grade {grade}")
-    print(f"📋 Question IDs: {question_ids}")
-    print(f"\n🚀 Starting parallel processing with {max_workers} workers...\n")
+    logger.info("✅ Found %s questions for grade %s", len(question_ids), grade)
+    logger.info("📋 Question IDs: %s", question_ids)
+    logger.info("\n🚀 Starting parallel processing with %s workers...\n", max_workers)
     
-    # Process questions in parallel using ThreadPoolExecutor
-    results = []
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(analyze_question, qid): qid for qid in question_ids}
-        
-        completed = 0
-        for future in futures:
-            try:
-                result = future.result()
-                results.append(result)
-                completed += 1
-                print(f"\n✅ Progress: {completed}/{len(question_ids)} questions completed")
-            except Exception as e:
-                qid = futures[future]
-                print(f"\n❌ Error processing question {qid}: {str(e)}")
-                results.append({"question_id": qid, "error": str(e)})
+    results = run_async(analyze_batch(question_ids, max_concurrency=max_workers, questions=questions))
     
     # Summary
-    print(f"\n{'='*60}")
-    print(f"📊 SUMMARY FOR GRADE {grade}")
-    print(f"{'='*60}")
-    print(f"Total Questions: {len(results)}")
+    logger.info("\n" + "=" * 60)
+    logger.info("📊 SUMMARY FOR GRADE %s", grade)
+    logger.info("=" * 60)
+    logger.info("Total Questions: %s", len(results))
     
     successful = [r for r in results if 'error' not in r]
     images_required = sum(1 for r in successful if r.get('image_required'))
     
-    print(f"Successfully Analyzed: {len(successful)}")
-    print(f"Images Required: {images_required}")
-    print(f"No Images Needed: {len(successful) - images_required}")
-    print(f"Errors: {len(results) - len(successful)}")
+    decided_by_rules = sum(1 for r in successful if r.get('reason', '').startswith("Rule "))
+    
+    logger.info("Successfully Analyzed: %s", len(successful))
+    logger.info("Decided by Rules (no API call): %s (%.0f%%)", decided_by_rules,
+                100 * decided_by_rules / len(results) if results else 0)
+    logger.info("Images Required: %s", images_required)
+    logger.info("No Images Needed: %s", len(successful) - images_required)
+    logger.info("Errors: %s", len(results) - len(successful))
     
     return results
 
-# def validate_prompts(result):
-#     """Validate that generated prompts meet quality standards"""
+# Batch API (50% cheaper, results within 24h) for bulk backfills that don't need answers right away.
+# Batch request bodies are plain JSON, so the VisualPlan schema is spelled out instead of passed as a class.
+BATCH_ENDPOINT = "/v1/chat/completions"
+VISUAL_PLAN_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "VisualPlan",
+        "strict": True,
+        "schema": VisualPlan.model_json_schema()
+    }
+}
+
+def _dumps_line(record):
+    """One UTF-8 JSONL line (orjson when installed)"""
+    if orjson is not None:
+        return orjson.dumps(record)
+    return json.dumps(record, ensure_ascii=False).encode("utf-8")
+
+async def submit_batch(question_ids):
+    """
+    Queue questions on the OpenAI Batch API
     
-#     prompts_to_check = {
-#         'question_image_prompt': 'Question',
-#         'option_a_image_prompt': 'Option A',
-#         'option_b_image_prompt': 'Option B',
-#         'option_c_image_prompt': 'Option C',
-#         'option_d_image_prompt': 'Option D'
-#     }
+    Args:
+        question_ids: Question IDs to analyze
     
-#     print("\n🔍 Validating prompt quality...")
+    Returns:
+        str: Batch id to pass to collect_batch (None if no question needed the model)
+    """
     
-#     for prompt_key, label in prompts_to_check.items():
-#         prompt = result.get(prompt_key)
-        
-#         if prompt:
-#             word_count = len(prompt.split())
+    questions = await asyncio.to_thread(fetch_questions_bulk, question_ids)
+    missing = [qid for qid in question_ids if qid not in questions]
+    if missing:
+        logger.warning("⚠️  Skipping %s question(s) not found: %s", len(missing), missing)
+    
+    # Rule-decided questions are saved now instead of being sent
+    decided = [d for d in map(rule_based_decision, questions.values()) if d is not None]
+    if decided:
+        logger.info("⚡ %s question(s) decided by rules, saving without the Batch API", len(decided))
+        saved = await asyncio.to_thread(save_many_to_database, decided)
+        if saved < len(decided):
+            logger.error("❌ Only %s of %s rule decisions were saved to the database", saved, len(decided))
+        decided_ids = {d['question_id'] for d in decided}
+        questions = {qid: q for qid, q in questions.items() if qid not in decided_ids}
+    
+    lines = [
+        _dumps_line({
+            "custom_id": f"question-{qid}",
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {**_chat_request(q), "response_format": VISUAL_PLAN_RESPONSE_FORMAT}
+        })
+        for qid, q in questions.items()
+    ]
+    if not lines:
+        logger.info("✅ Nothing left to submit")
+        return None
+    
+    client = get_client()
+    batch_file = await client.files.create(
+        file=("visual_batch.jsonl", b"\n".join(lines)),
+        purpose="batch"
+    )
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window="24h"
+    )
+    
+    logger.info("📤 Submitted %s questions as batch %s", len(lines), batch.id)
+    return batch.id
+
+async def collect_batch(batch_id, poll_interval=60):
+    """
+    Wait for a submitted batch, then validate and save its results
+    
+    Args:
+        batch_id: Id returned by submit_batch
+        poll_interval: Seconds between status checks (default: 60)
+    
+    Returns:
+        list: One result per request in the batch ({"question_id", "error"} on failure)
+    """
+    
+    client = get_client()
+    batch = await client.batches.retrieve(batch_id)
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        logger.info("⏳ Batch %s: %s (%s/%s done)", batch_id, batch.status,
+                    batch.request_counts.completed, batch.request_counts.total)
+        await asyncio.sleep(poll_interval)
+        batch = await client.batches.retrieve(batch_id)
+    
+    if not batch.output_file_id:
+        raise RuntimeError(f"Batch {batch_id} ended as '{batch.status}' without output")
+    
+    content = await client.files.content(batch.output_file_id)
+    results = []
+    saver = _ChunkedSaver()
+    try:
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            record = orjson.loads(line) if orjson is not None else json.loads(line)
+            qid = int(record["custom_id"].removeprefix("question-"))
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                error = record.get("error") or response.get("body", {}).get("error")
+                logger.error("\n❌ Error processing question %s: %s", qid, error)
+                results.append({"question_id": qid, "error": str(error)})
+                continue
             
-#             # Check minimum length
-#             if word_count < 80:
-#                 print(f"⚠️  {label}: Only {word_count} words (should be 100-150)")
-#             else:
-#                 print(f"✅ {label}: {word_count} words")
+            body = response["body"]
+            usage = body.get("usage") or {}
+            log_token_usage({
+                "question_id": qid,
+                "prompt_tokens": usage.get("prompt_tokens", 0),
+                "cached_tokens": (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0),
+                "completion_tokens": usage.get("completion_tokens", 0),
+                "total_tokens": usage.get("total_tokens", 0),
+                "mode": "batch",
+            })
             
-#             # Check for vague terms
-#             vague_terms = ['colorful', 'nice', 'good', 'simple', 'beautiful', 'pretty']
-#             found_vague = [term for term in vague_terms if term in prompt.lower()]
-#             if found_vague:
-#                 print(f"⚠️  {label}: Contains vague terms: {', '.join(found_vague)}")
-    
-#     # Check option consistency
-#     option_prompts = [
-#         result.get('option_a_image_prompt'),
-#         result.get('option_b_image_prompt'),
-#         result.get('option_c_image_prompt'),
-#         result.get('option_d_image_prompt')
-#     ]
-    
-#     non_null_count = sum(1 for p in option_prompts if p is not None)
-    
-#     if non_null_count > 0 and non_null_count < 4:
-#         print(f"\n⚠️  FAIRNESS WARNING: Only {non_null_count}/4 options have images!")
-#         print(f"   This may give unfair hints to students.")
-#     elif non_null_count == 4:
-#         print(f"\n✅ All 4 options have images - Fair assessment maintained")
-    
-#     return result
+            # A truncated (finish_reason=length) or malformed output fails only its own question
+            try:
+                message = body["choices"][0]["message"]
+                if not message.get("content"):
+                    raise ValueError(f"Model refused: {message.get('refusal')}")
+                result = validate_prompts(VisualPlan.model_validate_json(message["content"]).model_dump())
+            except Exception as e:
+                logger.error("\n❌ Error processing question %s: %s", qid, e)
+                results.append({"question_id": qid, "error": str(e)})
+                continue
+            
+            results.append(result)
+            await saver.add(result)
+    finally:
+        await saver.flush()
+    
+    return results
 
-def log_token_usage(tokens_info):
-    """Log token usage to file for analysis"""
-    import datetime
-    
-    log_file = "token_usage_log.txt"
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    log_entry = f"""
-{'='*60}
-Timestamp: {timestamp}
-Question ID: {tokens_info['question_id']}
-Prompt Tokens: {tokens_info['prompt_tokens']}
-Completion Tokens: {tokens_info['completion_tokens']}
-Total Tokens: {tokens_info['total_tokens']}
-{'='*60}
-"""
+async def analyze_questions_by_grade_batch(grade, poll_interval=60):
+    """
+    Analyze all questions for a grade through the Batch API and wait for the results
+    
+    Args:
+        grade: The grade level (1-12)
+        poll_interval: Seconds between batch status checks (default: 60)
+    
+    Returns:
+        list: Results from collect_batch (empty if skip rules decided every question)
+    """
+    
+    question_ids = await asyncio.to_thread(fetch_questions_by_grade, grade)
+    if not question_ids:
+        logger.error("❌ No questions found for grade %s", grade)
+        return []
+    
+    batch_id = await submit_batch(question_ids)
+    if batch_id is None:
+        return []
+    return await collect_batch(batch_id, poll_interval=poll_interval)
+
+# Vague terms the system prompt forbids, matched as whole words in one case-insensitive scan
+_VAGUE_TERMS = re.compile(r"\b(?:colorful|nice|good|simple|beautiful|pretty)\b", re.IGNORECASE)
+
+MIN_PROMPT_WORDS = 80
+
+PROMPT_LABELS = {
+    'question_image_prompt': 'Question',
+    'option_a_image_prompt': 'Option A',
+    'option_b_image_prompt': 'Option B',
+    'option_c_image_prompt': 'Option C',
+    'option_d_image_prompt': 'Option D'
+}
+
+OPTION_PROMPT_KEYS = tuple(key for key in PROMPT_LABELS if key.startswith('option_'))
+
+def weak_prompts(result):
+    """Keys of the generated prompts that are too short or use vague terms"""
+    return [
+        key for key in PROMPT_LABELS
+        if result.get(key) and (result[key].count(" ") + 1 < MIN_PROMPT_WORDS or _VAGUE_TERMS.search(result[key]))
+    ]
+
+REGENERATE_PROMPT_TEMPLATE = string.Template("""These image prompts are too short or use forbidden vague terms: $fields
+
+Rewrite ONLY these prompts. Each must be 100-150 words, follow the mandatory prompt structure, avoid every forbidden term, and keep the exact style, colors, lighting and framing of the other option prompts.""")
+
+async def regenerate_weak_prompts(result, request):
+    """
+    Rewrite every weak prompt of one analysis in a single call
+    
+    Args:
+        result: Validated analysis from analyze_question
+        request: The _chat_request that produced it (conversation is continued so the system prefix stays cached)
+    
+    Returns:
+        dict: `result` with the weak prompts replaced (unchanged if none were weak)
+    """
+    
+    keys = weak_prompts(result)
+    if not keys:
+        return result
+    
+    logger.info("\n🔁 Regenerating %s weak prompt(s) in one call...", len(keys))
+    response = await _parse_completion(
+        {
+            **request,
+            "messages": [
+                *request["messages"],
+                {"role": "assistant", "content": json.dumps(result, ensure_ascii=False)},
+                {"role": "user", "content": REGENERATE_PROMPT_TEMPLATE.substitute(fields=", ".join(keys))}
+            ]
+        },
+        PromptRewrites
+    )
+    
+    rewrites = response.choices[0].message.parsed
+    if rewrites is None:
+        logger.warning("⚠️  Model refused to regenerate prompts, keeping the originals")
+        return result
+    
+    usage = response.usage
+    cache_details = getattr(usage, "prompt_tokens_details", None)
+    log_token_usage({
+        "question_id": result['question_id'],
+        "prompt_tokens": usage.prompt_tokens,
+        "cached_tokens": getattr(cache_details, "cached_tokens", None) or 0,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens,
+    })
+    
+    result = {**result, **{r.field: r.prompt for r in rewrites.prompts if r.field in keys}}
+    return validate_prompts(result)
+
+def validate_prompts(result):
+    """Validate that generated prompts meet quality standards"""
     
-    with open(log_file, 'a', encoding='utf-8') as f:
-        f.write(log_entry)
+    logger.info("\n🔍 Validating prompt quality...")
     
-    print(f"✅ Token usage logged to {log_file}")
\ No newline at end of file
+    for prompt_key, label in PROMPT_LABELS.items():
+        prompt = result.get(prompt_key)
+        
+        if prompt:
+            # Approximate word count without building a list of words
+            word_count = prompt.count(" ") + 1
+            
+            # Check minimum length
+            if word_count < MIN_PROMPT_WORDS:
+                logger.warning("⚠️  %s: Only %s words (should be 100-150)", label, word_count)
+            else:
+                logger.info("✅ %s: %s words", label, word_count)
+            
+            # Check for vague terms
+            found_vague = {term.lower() for term in _VAGUE_TERMS.findall(prompt)}
+            if found_vague:
+                logger.warning("⚠️  %s: Contains vague terms: %s", label, ', '.join(sorted(found_vague)))
+    
+    # Check option consistency
+    non_null_count = sum(1 for key in OPTION_PROMPT_KEYS if result.get(key) is not None)
+    
+    if non_null_count > 0 and non_null_count < 4:
+        logger.warning("\n⚠️  FAIRNESS WARNING: Only %s/4 options have images!", non_null_count)
+        logger.warning("   This may give unfair hints to students.")
+    elif non_null_count == 4:
+        logger.info("\n✅ All 4 options have images - Fair assessment maintained")
+    
+    return result
+
+# Token price relative to realtime calls, logged so batch savings show up in the token log
+PRICE_MULTIPLIERS = {"realtime": 1.0, "batch": 0.5}
+
+def log_token_usage(tokens_info):
+    """Append token usage to token_usage_log.jsonl (one JSON object per call) for analysis"""
+    mode = tokens_info.get('mode', 'realtime')
+    get_token_logger().info(json.dumps({
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        **tokens_info,
+        "mode": mode,
+        "price_multiplier": PRICE_MULTIPLIERS[mode],
+    }))
@@ -1,24 +1,74 @@
-import os
+import logging
+import threading
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from contextlib import contextmanager
+from psycopg2.extensions import connection as PgConnection
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from settings import get_settings
 
-# Database connection
-def get_db():
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST"),
-        port=os.getenv("DB_PORT"),
-        database=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
+logger = logging.getLogger(__name__)
+
+class _PooledConnection(PgConnection):
+    """Connection that remembers which server-side prepared statements it holds"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+def _connect_kwargs():
+    settings = get_settings()
+    return dict(
+        host=settings.db_host,
+        port=settings.db_port,
+        database=settings.db_name,
+        user=settings.db_user,
+        password=settings.db_password,
         cursor_factory=RealDictCursor
     )
 
-def fetch_question(question_id):
-    """Fetch question with grade, subject, and topic"""
-    conn = get_db()
-    cur = conn.cursor()
-    
-    query = """
+# Database connection
+def get_db():
+    return psycopg2.connect(**_connect_kwargs())
+
+# Connection pool (created on first use)
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def _get_pool():
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                settings = get_settings()
+                _POOL = ThreadedConnectionPool(
+                    minconn=settings.db_pool_min,
+                    maxconn=settings.db_pool_max,
+                    connection_factory=_PooledConnection,
+                    **_connect_kwargs()
+                )
+    return _POOL
+
+@contextmanager
+def get_conn():
+    """Borrow a pooled connection and always hand it back"""
+    pool = _get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        if not conn.closed:
+            conn.rollback()  # end any open transaction before reuse
+        pool.putconn(conn, close=bool(conn.closed))
+
+def _execute_prepared(conn, cur, name, statement, params):
+    """PREPARE `statement` once per pooled connection, then EXECUTE it (skips re-parse/plan)"""
+    if name not in conn.prepared:
+        cur.execute(f"PREPARE {name} AS {statement}")
+        conn.prepared.add(name)
+    placeholders = ", ".join(["%s"] * len(params))
+    cur.execute(f"EXECUTE {name} ({placeholders})", params)
+
+FETCH_QUESTION_SQL = """
     SELECT q.question_id, q.question_text, q.option_a, q.option_b, 
            q.option_c, q.option_d, q.difficulty, 
            e.grade, e.exam, e.level,
@@ -28,20 +78,55 @@ def fetch_question(question_id):
     JOIN syllabus s ON q.syllabus_id = s.syllabus_id
     JOIN sections sec ON s.section_id = sec.section_id
     JOIN exam_overview e ON s.exam_overview_id = e.exam_overview_id
-    WHERE q.question_id = %s;
-    """
-    
-    cur.execute(query, (question_id,))
-    question = cur.fetchone()
+    WHERE q.question_id = $1
+"""
+
+FETCH_QUESTIONS_SQL = FETCH_QUESTION_SQL.replace(
+    "WHERE q.question_id = $1", "WHERE q.question_id = ANY($1::int[])"
+)
+
+FETCH_QUESTIONS_BY_GRADE_SQL = FETCH_QUESTION_SQL.replace(
+    "WHERE q.question_id = $1", "WHERE e.grade = $1 AND q.is_active = TRUE ORDER BY q.question_id"
+)
+
+FETCH_VISUAL_PROMPTS_SQL = """
+    SELECT id, question_id, image_required, question_image_prompt,
+           option_a_image_prompt, option_b_image_prompt,
+           option_c_image_prompt, option_d_image_prompt
+    FROM question_visual_prompts
+    WHERE question_id = ANY($1::int[]) AND image_required = TRUE
+    ORDER BY question_id, id
+"""
+
+def fetch_question(question_id):
+    """Fetch question with grade, subject, and topic"""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        _execute_prepared(conn, cur, "fetch_question", FETCH_QUESTION_SQL, (question_id,))
+        question = cur.fetchone()
     
-    conn.close()
     return question
 
+def fetch_questions_bulk(question_ids):
+    """Fetch many questions (with grade, subject, and topic) in one query ({question_id: row})"""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        _execute_prepared(conn, cur, "fetch_questions", FETCH_QUESTIONS_SQL, (list(question_ids),))
+        questions = {row['question_id']: row for row in cur.fetchall()}
+    
+    return questions
+
+def fetch_questions_full_by_grade(grade):
+    """Fetch every active question of a grade, full rows, in one query ({question_id: row}, by id)"""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        _execute_prepared(conn, cur, "fetch_questions_by_grade", FETCH_QUESTIONS_BY_GRADE_SQL, (grade,))
+        questions = {row['question_id']: row for row in cur.fetchall()}
+    
+    return questions
+
 def fetch_questions_by_grade(grade):
     """Fetch all question IDs for a specific grade"""
-    conn = get_db()
-    cur = conn.cursor()
-    
     query = """
     SELECT DISTINCT q.question_id
     FROM questions q
@@ -51,47 +136,110 @@ def fetch_questions_by_grade(grade):
     ORDER BY q.question_id;
     """
     
-    cur.execute(query, (grade,))
-    question_ids = [row['question_id'] for row in cur.fetchall()]
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(query, (grade,))
+        question_ids = [row['question_id'] for row in cur.fetchall()]
     
-    conn.close()
     return question_ids
 
+def fetch_visual_prompts_bulk(question_ids):
+    """Fetch stored image prompts for many questions in one query ({question_id: row})"""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        _execute_prepared(conn, cur, "fetch_visual_prompts", FETCH_VISUAL_PROMPTS_SQL, (list(question_ids),))
+        # Later rows win, so each question maps to its most recent analysis
+        prompts = {row['question_id']: row for row in cur.fetchall()}
+    
+    return prompts
+
 def save_to_database(result):
     """Save analysis result to database"""
-    conn = get_db()
-    cur = conn.cursor()
-    
-    try:
-        query = """
-        INSERT INTO question_visual_prompts 
-        (question_id, image_required, reason, question_image_prompt, 
-         option_a_image_prompt, option_b_image_prompt, 
-         option_c_image_prompt, option_d_image_prompt)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        RETURNING id;
-        """
+    with get_conn() as conn:
+        cur = conn.cursor()
         
-        cur.execute(query, (
-            result['question_id'],
-            result['image_required'],
-            result['reason'],
-            result.get('question_image_prompt'),
-            result.get('option_a_image_prompt'),
-            result.get('option_b_image_prompt'),
-            result.get('option_c_image_prompt'),
-            result.get('option_d_image_prompt')
-        ))
+        try:
+            query = """
+            INSERT INTO question_visual_prompts 
+            (question_id, image_required, reason, question_image_prompt, 
+             option_a_image_prompt, option_b_image_prompt, 
+             option_c_image_prompt, option_d_image_prompt)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING id;
+            """
+            
+            cur.execute(query, (
+                result['question_id'],
+                result['image_required'],
+                result['reason'],
+                result.get('question_image_prompt'),
+                result.get('option_a_image_prompt'),
+                result.get('option_b_image_prompt'),
+                result.get('option_c_image_prompt'),
+                result.get('option_d_image_prompt')
+            ))
+            
+            record_id = cur.fetchone()['id']
+            conn.commit()
+            
+            logger.info("✅ Saved to database with ID: %s", record_id)
+            return record_id
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error("❌ Database error: %s", e)
+            return None
+
+INSERT_VISUAL_PROMPTS_SQL = """
+    INSERT INTO question_visual_prompts 
+    (question_id, image_required, reason, question_image_prompt, 
+     option_a_image_prompt, option_b_image_prompt, 
+     option_c_image_prompt, option_d_image_prompt)
+    VALUES %s;
+"""
+
+def save_many_to_database(results):
+    """
+    Save many analysis results in one transaction (multi-row INSERT); returns the number saved
+    
+    If the multi-row INSERT fails, rows are retried one per transaction so a single bad row
+    only loses itself; callers compare the returned count against len(results).
+    """
+    rows = [(
+        result['question_id'],
+        result['image_required'],
+        result['reason'],
+        result.get('question_image_prompt'),
+        result.get('option_a_image_prompt'),
+        result.get('option_b_image_prompt'),
+        result.get('option_c_image_prompt'),
+        result.get('option_d_image_prompt')
+    ) for result in results]
+    
+    if not rows:
+        return 0
+    
+    with get_conn() as conn:
+        cur = conn.cursor()
         
-        record_id = cur.fetchone()['id']
-        conn.commit()
+        try:
+            execute_values(cur, INSERT_VISUAL_PROMPTS_SQL, rows, page_size=500)
+            conn.commit()
+            logger.info("✅ Saved %s analyses to database", len(rows))
+            return len(rows)
+        except Exception as e:
+            conn.rollback()
+            logger.warning("⚠️  Multi-row save of %s analyses failed (%s), saving one by one", len(rows), e)
         
-        print(f"✅ Saved to database with ID: {record_id}")
-        return record_id
+        saved = 0
+        for row in rows:
+            try:
+                execute_values(cur, INSERT_VISUAL_PROMPTS_SQL, [row])
+                conn.commit()
+                saved += 1
+            except Exception as e:
+                conn.rollback()
+                logger.error("❌ Database error saving question %s: %s", row[0], e)
         
-    except Exception as e:
-        conn.rollback()
-        print(f"❌ Database error: {str(e)}")
-        return None
-    finally:
-        conn.close()
\ No newline at end of file
+        logger.info("✅ Saved %s/%s analyses to database", saved, len(rows))
+        return saved
@@ -1,17 +1,140 @@
 import os
+import asyncio
+import logging
+import hashlib
+import shutil
+import threading
+import time
 import google.generativeai as genai
-from PIL import Image
-from io import BytesIO
-from dotenv import load_dotenv
+from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable
 from pathlib import Path
+from settings import get_settings
+from rate_limiter import get_limiter, estimate_tokens
+from database import fetch_visual_prompts_bulk
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 # Create images folder if it doesn't exist
 IMAGES_FOLDER = "gemini_generated_images"
 Path(IMAGES_FOLDER).mkdir(exist_ok=True)
 
-def generate_image(prompt, question_id, image_type="question", option=None):
+MODEL_NAME = "gemini-2.5-flash-image"
+IMAGE_OUTPUT_TOKENS = 1290  # Gemini bills each generated image as ~1290 output tokens
+
+# 429/503 from Gemini: pause every worker on the shared limiter, then retry
+RATE_LIMIT_PAUSE_SECONDS = 30
+RATE_LIMIT_RETRIES = 2
+
+# Generated PNGs are cached by (prompt, model) hash so re-runs skip Gemini entirely
+CACHE_FOLDER = os.path.join(IMAGES_FOLDER, "_cache")
+CACHE_MAX_BYTES = get_settings().image_cache_max_mb * 1024 * 1024
+EVICT_INTERVAL_SECONDS = 60  # rescan the cache for eviction at most this often
+
+# Configure the SDK and build the model once per process instead of on every image
+GEMINI_API_KEY = get_settings().gemini_api_key
+if GEMINI_API_KEY:
+    genai.configure(api_key=GEMINI_API_KEY)
+_MODEL = genai.GenerativeModel(MODEL_NAME)
+
+# Per-prompt locks (keyed by cache path) for generate_image's in-flight dedupe
+_PROMPT_LOCKS = {}
+_PROMPT_LOCKS_GUARD = threading.Lock()
+
+_EVICT_LOCK = threading.Lock()
+_last_evict = 0.0
+
+def _cache_path(prompt):
+    key = hashlib.sha256(prompt.encode("utf-8") + MODEL_NAME.encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_FOLDER, f"{key}.png")
+
+def _evict_cache():
+    """
+    Drop least recently used cache entries until the cache fits in CACHE_MAX_BYTES
+    
+    Only entries no per-question file is hard-linked to count: removing a linked entry frees
+    no disk space and would just force a Gemini call the next time that prompt is used.
+    Runs at most once per EVICT_INTERVAL_SECONDS, since it stats the whole cache.
+    """
+    global _last_evict
+    with _EVICT_LOCK:
+        now = time.monotonic()
+        if now - _last_evict < EVICT_INTERVAL_SECONDS:
+            return
+        _last_evict = now
+    
+    entries = []
+    for entry in os.scandir(CACHE_FOLDER):
+        if not entry.name.endswith(".png"):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        if stat.st_nlink == 1:
+            entries.append((entry.path, stat))
+    total = sum(stat.st_size for _, stat in entries)
+    if total <= CACHE_MAX_BYTES:
+        return
+    
+    # mtime is bumped on every hit, so oldest mtime == least recently used
+    for path, stat in sorted(entries, key=lambda item: item[1].st_mtime):
+        try:
+            os.remove(path)
+            total -= stat.st_size
+        except FileNotFoundError:
+            continue
+        if total <= CACHE_MAX_BYTES:
+            break
+
+def _link_or_copy(cache_path, file_path):
+    """
+    Expose a cached PNG under its per-question name
+    
+    Hard-linked when the filesystem allows it (no second copy of the bytes on disk), copied otherwise.
+    """
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(cache_path, file_path)
+    except OSError:
+        shutil.copyfile(cache_path, file_path)
+
+def _write_cache_entry(image_bytes, mime_type, cache_path):
+    """
+    Store a generated image under cache_path atomically
+    
+    Other workers check for cache_path without holding the prompt lock, so the bytes are written
+    to a private temp file first and renamed into place: readers see the whole PNG or nothing.
+    """
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        if mime_type == "image/png":
+            Path(tmp_path).write_bytes(image_bytes)
+        else:
+            _decode_and_save(image_bytes, tmp_path)
+        os.replace(tmp_path, cache_path)
+    finally:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+
+def _decode_and_save(image_bytes, output_path):
+    """
+    Re-encode non-PNG image bytes (e.g. JPEG) as PNG so files match their .png names
+    
+    CPU-bound: only call from a worker thread (generate_image runs under asyncio.to_thread),
+    never directly on the event loop. Pillow is imported here because PNG responses (the usual
+    case) are written as-is and never need it.
+    """
+    from io import BytesIO
+    from PIL import Image
+    
+    Image.open(BytesIO(image_bytes)).save(output_path, format="PNG")
+
+def generate_image(prompt, question_id, image_type="question", option=None, force=False):
     """
     Generate image from prompt using Gemini API
     
@@ -20,20 +143,12 @@ def generate_image(prompt, question_id, image_type="question", option=None):
         question_id (int): Question ID for naming
         image_type (str): "question" or "option"
         option (str): "a", "b", "c", or "d" if image_type is "option"
+        force (bool): Call Gemini even if this prompt's image is already on disk
     
     Returns:
-        dict: {"success": bool, "file_path": str or None, "error": str or None}
+        dict: {"success": bool, "file_path": str or None, "error": str or None, "cached": bool}
     """
     
-    api_key = os.getenv("GEMINI_API_KEY")
-    
-    if not api_key:
-        return {
-            "success": False,
-            "file_path": None,
-            "error": "GEMINI_API_KEY not found in .env"
-        }
-    
     # Build filename
     if image_type == "question":
         filename = f"q_{question_id}_question.png"
@@ -42,24 +157,99 @@ def generate_image(prompt, question_id, image_type="question", option=None):
     
     file_path = os.path.join(IMAGES_FOLDER, filename)
     
-    print(f"\n🎨 Generating image: {filename}")
-    print(f"   Prompt preview: {prompt[:80]}...")
+    cache_path = _cache_path(prompt)
+    if force:
+        with _prompt_lock(cache_path):
+            return _generate_uncached(prompt, filename, file_path, cache_path)
+    
+    # Same prompt already generated before? Reuse it without calling Gemini
+    reused = _reuse_cached(cache_path, file_path)
+    if reused:
+        return reused
+    
+    # Identical prompts in flight at once (repeated option prompts, concurrent questions) wait
+    # for the first call and then reuse its image instead of each paying for Gemini
+    with _prompt_lock(cache_path):
+        return _reuse_cached(cache_path, file_path) or _generate_uncached(prompt, filename, file_path, cache_path)
+
+def _reuse_cached(cache_path, file_path):
+    """
+    generate_image result served from the image cache, or None on miss
+    
+    A resumed run finds most files already hard-linked to this prompt's cache entry; those are
+    left alone (one stat() each). A file that merely exists under the same name is not trusted,
+    since its question's prompt may have changed since it was written.
+    """
+    try:
+        if os.path.samefile(cache_path, file_path):
+            os.utime(cache_path)  # mark as recently used
+            return {
+                "success": True,
+                "file_path": file_path,
+                "error": None,
+                "cached": True
+            }
+    except FileNotFoundError:
+        pass
     
+    if not os.path.exists(cache_path):
+        return None
     try:
-        # Configure Gemini with API key
-        genai.configure(api_key=api_key)
-        
-        # Create model instance
-        model = genai.GenerativeModel("gemini-2.5-flash-image")
-        
-        # Generate image
-        print("   Calling Gemini API...")
-        response = model.generate_content(prompt)
+        _link_or_copy(cache_path, file_path)
+        os.utime(cache_path)  # mark as recently used
+    except FileNotFoundError:
+        return None  # evicted by another worker, regenerate
+    logger.debug("♻️  Reused cached image: %s", file_path)
+    return {
+        "success": True,
+        "file_path": file_path,
+        "error": None,
+        "cached": True
+    }
+
+def _prompt_lock(cache_path):
+    """Lock shared by every generate_image call for the same prompt"""
+    with _PROMPT_LOCKS_GUARD:
+        return _PROMPT_LOCKS.setdefault(cache_path, threading.Lock())
+
+def _generate_uncached(prompt, filename, file_path, cache_path):
+    """Call Gemini, store the image in the cache and link it to file_path"""
+    
+    if not GEMINI_API_KEY:
+        return {
+            "success": False,
+            "file_path": None,
+            "error": "GEMINI_API_KEY not found in .env"
+        }
+    
+    logger.info("\n🎨 Generating image: %s", filename)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("   Prompt preview: %s...", prompt[:80])
+    
+    try:
+        # Generate image (reserve quota first so parallel workers don't trip 429s)
+        limiter = get_limiter("gemini", MODEL_NAME)
+        estimated_tokens = estimate_tokens(prompt) + IMAGE_OUTPUT_TOKENS
+        logger.debug("   Calling Gemini API...")
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            try:
+                with limiter.reserve(estimated_tokens):
+                    response = _MODEL.generate_content(prompt)
+                break
+            except (ResourceExhausted, ServiceUnavailable):
+                if attempt == RATE_LIMIT_RETRIES:
+                    raise
+                # One back-off for every worker instead of each of them retrying into more 429s
+                logger.warning("   ⏳ Gemini rate limited, pausing all image workers for %ss", RATE_LIMIT_PAUSE_SECONDS)
+                limiter.pause(RATE_LIMIT_PAUSE_SECONDS)
+        usage = getattr(response, "usage_metadata", None)
+        if usage:
+            limiter.refund(estimated_tokens - usage.total_token_count)
         
         # Check if response has content
         if not response.candidates:
             error_msg = "No image generated in response"
-            print(f"❌ {error_msg}")
+            logger.error("❌ %s", error_msg)
             return {
                 "success": False,
                 "file_path": None,
@@ -70,7 +260,7 @@ def generate_image(prompt, question_id, image_type="question", option=None):
         candidate = response.candidates[0]
         if not candidate.content.parts:
             error_msg = "No image data in response parts"
-            print(f"❌ {error_msg}")
+            logger.error("❌ %s", error_msg)
             return {
                 "success": False,
                 "file_path": None,
@@ -84,41 +274,46 @@ def generate_image(prompt, question_id, image_type="question", option=None):
             part=candidate.content.parts[1]
             if not hasattr(part, 'inline_data') or not part.inline_data:
                 error_msg = "No inline_data found in response"
-                print(f"❌ {error_msg}")
+                logger.error("❌ %s", error_msg)
                 return {
                     "success": False,
                     "file_path": None,
                     "error": error_msg
                 }
         
-        # Convert bytes to image and save
+        # Gemini already returns encoded PNG bytes, so write them as-is
         image_bytes = part.inline_data.data
-        image = Image.open(BytesIO(image_bytes))
-        image.save(file_path)
+        Path(CACHE_FOLDER).mkdir(exist_ok=True)
+        _write_cache_entry(image_bytes, getattr(part.inline_data, "mime_type", "image/png"), cache_path)
+        _link_or_copy(cache_path, file_path)
+        _evict_cache()
         
-        print(f"✅ Image saved: {file_path}")
+        logger.info("✅ Image saved: %s", file_path)
         return {
             "success": True,
             "file_path": file_path,
-            "error": None
+            "error": None,
+            "cached": False
         }
     
     except Exception as e:
         error_msg = f"Error generating image: {str(e)}"
-        print(f"❌ {error_msg}")
+        logger.error("❌ %s", error_msg)
         return {
             "success": False,
             "file_path": None,
             "error": error_msg
         }
 
-def generate_images_for_question(question_id, prompts_data):
+async def generate_images_for_question_async(question_id, prompts_data, sem=None, force=False):
     """
-    Generate all images for a question (question + 4 options)
+    Generate all images for a question (question + 4 options) concurrently
     
     Args:
         question_id (int): Question ID
         prompts_data (dict): Dictionary containing all prompts from AI analysis
+        sem (asyncio.Semaphore): Shared cap on Gemini calls in flight across questions (optional)
+        force (bool): Regenerate every image even if it is already cached
     
     Returns:
         dict: Results for all generated images
@@ -127,49 +322,94 @@ def generate_images_for_question(question_id, prompts_data):
     results = {
         "question_id": question_id,
         "images_generated": 0,
+        "images_cached": 0,
         "images_failed": 0,
         "details": {}
     }
     
-    print(f"\n{'='*60}")
-    print(f"🎨 GENERATING IMAGES FOR QUESTION {question_id}")
-    print(f"{'='*60}")
+    logger.info("\n" + "=" * 60)
+    logger.info("🎨 GENERATING IMAGES FOR QUESTION %s", question_id)
+    logger.info("=" * 60)
     
-    # Generate question image
+    # Collect every image that has a prompt (question image + option images)
+    jobs = []
     if prompts_data.get('question_image_prompt'):
-        result = generate_image(
+        jobs.append(('question', dict(
             prompt=prompts_data['question_image_prompt'],
             question_id=question_id,
-            image_type="question"
-        )
-        results['details']['question'] = result
-        if result['success']:
-            results['images_generated'] += 1
-        else:
-            results['images_failed'] += 1
+            image_type="question",
+            force=force
+        )))
     
-    # Generate option images
     options = ['a', 'b', 'c', 'd']
     for opt in options:
         prompt_key = f'option_{opt}_image_prompt'
         if prompts_data.get(prompt_key):
-            result = generate_image(
+            jobs.append((f'option_{opt}', dict(
                 prompt=prompts_data[prompt_key],
                 question_id=question_id,
                 image_type="option",
-                option=opt
-            )
-            results['details'][f'option_{opt}'] = result
-            if result['success']:
-                results['images_generated'] += 1
-            else:
-                results['images_failed'] += 1
+                option=opt,
+                force=force
+            )))
+    
+    # Gemini calls are blocking I/O, so run them side by side in worker threads
+    async def run(kwargs):
+        if sem is None:
+            return await asyncio.to_thread(generate_image, **kwargs)
+        async with sem:
+            return await asyncio.to_thread(generate_image, **kwargs)
+    
+    outcomes = await asyncio.gather(*[run(kwargs) for _, kwargs in jobs])
+    
+    for (key, _), result in zip(jobs, outcomes):
+        results['details'][key] = result
+        if result['success']:
+            results['images_generated'] += 1
+            if result.get('cached'):
+                results['images_cached'] += 1
+        else:
+            results['images_failed'] += 1
     
     # Summary
-    print(f"\n{'='*60}")
-    print(f"📊 GENERATION SUMMARY")
-    print(f"{'='*60}")
-    print(f"✅ Successfully generated: {results['images_generated']} images")
-    print(f"❌ Failed: {results['images_failed']} images")
+    logger.info("\n" + "=" * 60)
+    logger.info("📊 GENERATION SUMMARY")
+    logger.info("=" * 60)
+    logger.info("✅ Successfully generated: %s images", results['images_generated'])
+    logger.info("♻️  Reused from cache: %s images", results['images_cached'])
+    logger.info("❌ Failed: %s images", results['images_failed'])
+    
+    return results
+
+def generate_images_for_question(question_id, prompts_data, force=False):
+    """Sync wrapper around generate_images_for_question_async"""
+    return asyncio.run(generate_images_for_question_async(question_id, prompts_data, force=force))
+
+def generate_images_for_questions(question_ids, force=False):
+    """
+    Generate images for many questions using prompts stored in the database
+    
+    Args:
+        question_ids (list): Question IDs to generate images for
+        force (bool): Regenerate every image even if it is already cached
+    
+    Returns:
+        list: generate_images_for_question results, one per question with stored prompts
+    """
+    # One query for all questions, then local lookups
+    prompts_by_id = fetch_visual_prompts_bulk(question_ids)
+    
+    missing = [qid for qid in question_ids if qid not in prompts_by_id]
+    if missing:
+        logger.warning("⚠️  No image prompts stored for questions: %s", missing)
+    
+    # All questions share one event loop, so their images are generated side by side too,
+    # at most IMAGE_CONCURRENCY at a time (and within the Gemini rate limiter)
+    async def run_all():
+        sem = asyncio.Semaphore(get_settings().image_concurrency)
+        return await asyncio.gather(*[
+            generate_images_for_question_async(qid, prompts_by_id[qid], sem=sem, force=force)
+            for qid in question_ids if qid in prompts_by_id
+        ])
     
-    return results
\ No newline at end of file
+    return asyncio.run(run_all())
@@ -0,0 +1,70 @@
+"""
+Non-blocking Logging Setup
+
+Concurrent analyses only enqueue log records; a single QueueListener thread formats and writes
+them, so analyze_batch workers don't contend on stdout.
+"""
+
+import atexit
+import logging
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import List, Optional
+
+LOG_FORMAT = '%(message)s'  # progress output, same look as the interactive prints it replaced
+
+_listener: Optional[QueueListener] = None
+
+TOKEN_LOG_PATH = "token_usage_log.jsonl"
+TOKEN_LOG_MAX_BYTES = 10 * 1024 * 1024
+
+_token_logger: Optional[logging.Logger] = None
+_token_logger_lock = threading.Lock()
+
+def setup_queue_logging(level: int = logging.INFO, handlers: Optional[List[logging.Handler]] = None) -> None:
+    """Route all logging through a background QueueListener (safe to call more than once)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    if handlers is None:
+        handlers = [logging.StreamHandler(sys.stdout)]  # stdout, alongside main.py's menu prints
+    formatter = logging.Formatter(LOG_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()  # unbounded, so put() never blocks a worker
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+def get_token_logger() -> logging.Logger:
+    """
+    Logger that appends one JSON line per OpenAI call to TOKEN_LOG_PATH
+    
+    Its own queue and listener thread (rotating at TOKEN_LOG_MAX_BYTES) keep callers off the disk,
+    and it doesn't propagate, so usage records never reach the console.
+    """
+    global _token_logger
+    with _token_logger_lock:
+        if _token_logger is None:
+            handler = RotatingFileHandler(TOKEN_LOG_PATH, maxBytes=TOKEN_LOG_MAX_BYTES, backupCount=5, encoding="utf-8")
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            
+            log_queue = queue.SimpleQueue()
+            token_logger = logging.getLogger("tokens")
+            token_logger.addHandler(QueueHandler(log_queue))
+            token_logger.setLevel(logging.INFO)
+            token_logger.propagate = False
+            
+            listener = QueueListener(log_queue, handler)
+            listener.start()
+            atexit.register(listener.stop)
+            _token_logger = token_logger
+    return _token_logger
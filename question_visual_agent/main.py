@@ -1,7 +1,11 @@
 import json
-from agent import analyze_question, analyze_questions_by_grade
+from agent import analyze_question, analyze_questions_by_grade, submit_batch, collect_batch, run_async
+from database import fetch_questions_by_grade
+from logging_config import setup_queue_logging
 
 def main():
+    setup_queue_logging()
+    
     print("\n" + "="*60)
     print("🎨 QUESTION VISUAL ANALYSIS AGENT")
     print("="*60)
@@ -9,14 +13,16 @@ def main():
     print("\nChoose an option:")
     print("1. Analyze a single question by ID")
     print("2. Analyze all questions for a specific grade")
+    print("3. Submit all questions for a grade to the Batch API (cheaper, up to 24h)")
+    print("4. Collect a submitted batch")
     print("0. Exit")
     
-    choice = input("\nEnter your choice (0-2): ").strip()
+    choice = input("\nEnter your choice (0-4): ").strip()
     
     if choice == "1":
         # Single question analysis
         question_id = int(input("Enter question ID: "))
-        result = analyze_question(question_id)
+        result = run_async(analyze_question(question_id))
         
         print("\n" + "="*60)
         print("📊 FINAL RESULT")
@@ -35,6 +41,26 @@ def main():
         max_workers = int(max_workers) if max_workers else 5
         
         results = analyze_questions_by_grade(grade, max_workers)
+    
+    elif choice == "3":
+        # Grade-based analysis through the Batch API
+        grade = int(input("Enter grade (1-12): "))
+        
+        if grade < 1 or grade > 12:
+            print("❌ Invalid grade! Must be between 1 and 12.")
+            return
+        
+        batch_id = run_async(submit_batch(fetch_questions_by_grade(grade)))
+        if batch_id:
+            print(f"\n📌 Run option 4 with batch id {batch_id} to collect the results")
+    
+    elif choice == "4":
+        batch_id = input("Enter batch id: ").strip()
+        results = run_async(collect_batch(batch_id))
+        
+        successful = [r for r in results if 'error' not in r]
+        print(f"\nSuccessfully Analyzed: {len(successful)}")
+        print(f"Errors: {len(results) - len(successful)}")
         
     elif choice == "0":
         print("\n👋 Goodbye!")
@@ -0,0 +1,156 @@
+import os
+import time
+import asyncio
+import threading
+import weakref
+from contextlib import contextmanager, asynccontextmanager
+
+# Default (requests/min, tokens/min) per provider; override with e.g. GEMINI_REQUESTS_PER_MINUTE,
+# OPENAI_TOKENS_PER_MINUTE
+DEFAULT_LIMITS = {
+    "gemini": (60, 1000000),
+    "openai": (500, 200000),  # gpt-4o-mini, usage tier 1
+}
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously up to `per_minute` capacity"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1.0):
+        """Block until `amount` tokens are available and take them"""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def refund(self, amount):
+        """Give back unused tokens (a negative amount charges an underestimate)"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+class RateLimiter:
+    """Requests-per-minute + tokens-per-minute limiter for one provider/model"""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._paused_until = 0.0
+        self._pause_lock = threading.Lock()
+
+    def pause(self, seconds):
+        """Hold back every worker using this limiter for `seconds` (e.g. after one of them hit a 429)"""
+        with self._pause_lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @contextmanager
+    def reserve(self, estimated_tokens):
+        wait = self._paused_until - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self.requests.acquire()
+        self.tokens.acquire(estimated_tokens)
+        yield self
+
+    def refund(self, unused_tokens):
+        self.tokens.refund(unused_tokens)
+
+class AsyncTokenBucket:
+    """TokenBucket for coroutines: waiting yields to the event loop instead of blocking a thread"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1.0):
+        """Wait until `amount` tokens are available and take them"""
+        amount = min(amount, self.capacity)
+        while True:
+            async with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+    def refund(self, amount):
+        """Give back unused tokens (a negative amount charges an underestimate)"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class AsyncRateLimiter:
+    """RateLimiter for async callers (AsyncOpenAI analyses)"""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = AsyncTokenBucket(requests_per_minute)
+        self.tokens = AsyncTokenBucket(tokens_per_minute)
+
+    @asynccontextmanager
+    async def reserve(self, estimated_tokens):
+        await self.requests.acquire()
+        await self.tokens.acquire(estimated_tokens)
+        yield self
+
+    def refund(self, unused_tokens):
+        self.tokens.refund(unused_tokens)
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+def get_limiter(provider, model, limiter_class=RateLimiter):
+    """Get the shared limiter for a provider+model, creating it from env/defaults on first use"""
+    key = f"{provider}:{model}:{limiter_class.__name__}"
+    with _LIMITERS_LOCK:
+        if key not in _LIMITERS:
+            default_rpm, default_tpm = DEFAULT_LIMITS.get(provider, (60, 100000))
+            prefix = provider.upper()
+            _LIMITERS[key] = limiter_class(
+                requests_per_minute=float(os.getenv(f"{prefix}_REQUESTS_PER_MINUTE", default_rpm)),
+                tokens_per_minute=float(os.getenv(f"{prefix}_TOKENS_PER_MINUTE", default_tpm)),
+            )
+        return _LIMITERS[key]
+
+# Async limiters hold asyncio locks bound to one event loop, so each asyncio.run gets its own set
+_ASYNC_LIMITERS = weakref.WeakKeyDictionary()
+
+def get_async_limiter(provider, model):
+    """AsyncRateLimiter for a provider+model, shared within the running event loop"""
+    limiters = _ASYNC_LIMITERS.setdefault(asyncio.get_running_loop(), {})
+    key = f"{provider}:{model}"
+    if key not in limiters:
+        default_rpm, default_tpm = DEFAULT_LIMITS.get(provider, (60, 100000))
+        prefix = provider.upper()
+        limiters[key] = AsyncRateLimiter(
+            requests_per_minute=float(os.getenv(f"{prefix}_REQUESTS_PER_MINUTE", default_rpm)),
+            tokens_per_minute=float(os.getenv(f"{prefix}_TOKENS_PER_MINUTE", default_tpm)),
+        )
+    return limiters[key]
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token)"""
+    return len(text) // 4 + 1
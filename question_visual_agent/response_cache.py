@@ -0,0 +1,69 @@
+"""
+Persistent Response Cache for the Question Visual Agent
+
+Exact-match cache keyed on a sha256 of the full chat request (model, messages, temperature and
+response schema), stored in a local SQLite file under question_visual_agent/_cache/. Re-analyzing
+an unchanged question (re-runs of a grade, retried batches) returns the stored VisualPlan instead
+of paying for another OpenAI call.
+
+Disabled by default so a re-run can still ask for fresh prompts; enable with VISUAL_CACHE_ENABLED=1.
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import time
+from typing import Any, Dict, Optional
+
+try:
+    import orjson  # optional, faster (de)serialization of cached payloads
+except ImportError:
+    orjson = None
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_cache")
+CACHE_PATH = os.path.join(CACHE_DIR, "responses.sqlite3")
+
+def make_cache_key(payload: Dict[str, Any]) -> str:
+    """Stable sha256 over the request payload (key order doesn't matter)"""
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(CACHE_PATH, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+    return conn
+
+def get_cached(key: str) -> Optional[Dict[str, Any]]:
+    """Return the cached result for `key`, or None on miss"""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT payload FROM responses WHERE key = ?", (key,)).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    return orjson.loads(row[0]) if orjson is not None else json.loads(row[0])
+
+def set_cached(key: str, payload: Dict[str, Any]):
+    """Store `payload` under `key` (overwrites any previous entry)"""
+    if orjson is not None:
+        raw = orjson.dumps(payload).decode("utf-8")
+    else:
+        raw = json.dumps(payload, ensure_ascii=False)
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, payload, created_at) VALUES (?, ?, ?)",
+                (key, raw, time.time())
+            )
+    finally:
+        conn.close()
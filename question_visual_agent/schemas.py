@@ -0,0 +1,37 @@
+from typing import List, Literal, Optional
+from pydantic import BaseModel, ConfigDict, Field
+
+class VisualPlan(BaseModel):
+    """Structured output of analyze_question (same keys save_to_database expects)"""
+    model_config = ConfigDict(extra="forbid")  # additionalProperties: false, required by strict schemas
+    question_id: int
+    grade: int
+    image_required: bool
+    reason: str = Field(..., description="Brief explanation of decision (one or two sentences)")
+    question_image_prompt: Optional[str] = Field(..., description="100-150 word prompt, or null")
+    option_a_image_prompt: Optional[str] = Field(..., description="100-150 word prompt, or null")
+    option_b_image_prompt: Optional[str] = Field(..., description="100-150 word prompt, or null")
+    option_c_image_prompt: Optional[str] = Field(..., description="100-150 word prompt, or null")
+    option_d_image_prompt: Optional[str] = Field(..., description="100-150 word prompt, or null")
+
+class VisualPlans(BaseModel):
+    """Structured output of analyze_questions_bulk (one VisualPlan per question in the request)"""
+    model_config = ConfigDict(extra="forbid")
+    results: List[VisualPlan]
+
+class PromptRewrite(BaseModel):
+    """One regenerated image prompt (see regenerate_weak_prompts)"""
+    model_config = ConfigDict(extra="forbid")
+    field: Literal[
+        "question_image_prompt",
+        "option_a_image_prompt",
+        "option_b_image_prompt",
+        "option_c_image_prompt",
+        "option_d_image_prompt",
+    ]
+    prompt: str = Field(..., description="100-150 word prompt")
+
+class PromptRewrites(BaseModel):
+    """All prompts rewritten in one call"""
+    model_config = ConfigDict(extra="forbid")
+    prompts: List[PromptRewrite]
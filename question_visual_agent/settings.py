@@ -0,0 +1,58 @@
+"""
+Settings for the Question Visual Agent
+
+.env and the environment are read once per process; modules take their values from get_settings()
+instead of calling load_dotenv()/os.getenv themselves.
+"""
+
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+from dotenv import load_dotenv
+
+@dataclass(slots=True, frozen=True)
+class Settings:
+    """Process-wide settings (immutable, safe to share between threads and tasks)"""
+
+    openai_api_key: Optional[str] = None
+    gemini_api_key: Optional[str] = None
+    openai_concurrency: int = 32  # analyze_batch calls in flight at once
+    response_cache_enabled: bool = False  # reuse stored analyses for identical requests
+    regenerate_weak_prompts: bool = False  # one extra call to rewrite short/vague prompts
+    visual_model_high_grades: str = "gpt-4o-mini"  # model for grades 9+ (e.g. gpt-4o)
+
+    # Database
+    db_host: Optional[str] = None
+    db_port: Optional[str] = None
+    db_name: Optional[str] = None
+    db_user: Optional[str] = None
+    db_password: Optional[str] = None
+    db_pool_min: int = 2
+    db_pool_max: int = 20
+
+    # Image generation
+    image_concurrency: int = 16  # Gemini calls in flight across all questions of a run
+    image_cache_max_mb: int = 5120
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Load .env once and build the shared Settings"""
+    load_dotenv()
+    return Settings(
+        openai_api_key=os.getenv("OPENAI_API_KEY"),
+        gemini_api_key=os.getenv("GEMINI_API_KEY"),
+        openai_concurrency=int(os.getenv("OPENAI_CONCURRENCY", 32)),
+        response_cache_enabled=os.getenv("VISUAL_CACHE_ENABLED", "0").lower() in ("1", "true", "yes"),
+        regenerate_weak_prompts=os.getenv("VISUAL_REGENERATE_WEAK_PROMPTS", "0").lower() in ("1", "true", "yes"),
+        visual_model_high_grades=os.getenv("VISUAL_MODEL_HIGH_GRADES", "gpt-4o-mini"),
+        db_host=os.getenv("DB_HOST"),
+        db_port=os.getenv("DB_PORT"),
+        db_name=os.getenv("DB_NAME"),
+        db_user=os.getenv("DB_USER"),
+        db_password=os.getenv("DB_PASSWORD"),
+        db_pool_min=int(os.getenv("DB_POOL_MIN", 2)),
+        db_pool_max=int(os.getenv("DB_POOL_MAX", 20)),
+        image_concurrency=int(os.getenv("IMAGE_CONCURRENCY", 16)),
+        image_cache_max_mb=int(os.getenv("IMAGE_CACHE_MAX_MB", 5120)),
+    )
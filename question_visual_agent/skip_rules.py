@@ -0,0 +1,89 @@
+"""
+Rule-based "no image needed" decisions for the Question Visual Agent
+
+Questions matching a rule are saved as image_required = false without calling OpenAI. Rules are
+plain data so they can be edited without touching agent code; a rule matches when EVERY condition
+it sets holds:
+    - question_pattern: regex searched (case-insensitive) in the question text
+    - min_grade:        question grade is at least this
+    - sections:         question section is one of these names
+    - unless_pattern:   regex that must NOT appear in the question text or options
+
+Keep rules conservative: a wrongly skipped question silently loses its images.
+"""
+
+import re
+from typing import Any, Dict, Optional
+
+# Any mention of a visual in the question or options means a rule must not skip it
+VISUAL_REFERENCE_PATTERN = r"\b(?:diagram|figure|shape|circle|triangle|graph|picture|image|map)s?\b"
+
+SKIP_RULES = [
+    {
+        "id": "R1",
+        "reason": "Statement-evaluation question; the answer depends on text, not on a visual",
+        "min_grade": 6,
+        "question_pattern": r"\bwhich of the following (?:statements? )?(?:is|are) (?:true|false|correct|incorrect)\b",
+        "unless_pattern": VISUAL_REFERENCE_PATTERN,
+    },
+    {
+        "id": "R2",
+        "reason": "Vocabulary question (synonym/antonym/meaning of a word)",
+        "question_pattern": r"\b(?:synonym|antonym|opposite|meaning) of\b",
+        "unless_pattern": VISUAL_REFERENCE_PATTERN,
+    },
+    {
+        "id": "R3",
+        "reason": "Abbreviation question; a full form cannot be pictured",
+        "question_pattern": r"\b(?:full form|stands for|abbreviation)\b",
+        "unless_pattern": VISUAL_REFERENCE_PATTERN,
+    },
+    {
+        "id": "R4",
+        "reason": "Text-based question for grades 9+, where images are rarely needed",
+        "min_grade": 9,
+        "question_pattern": r"\b(?:fill in the blank|complete the (?:sentence|statement))\b",
+    },
+    {
+        "id": "R5",
+        "reason": "Language section question with no diagram, figure or picture reference",
+        "sections": ["English", "Grammar"],
+        "unless_pattern": VISUAL_REFERENCE_PATTERN,
+    },
+]
+
+def _compile(pattern):
+    return re.compile(pattern, re.IGNORECASE) if pattern else None
+
+# Compiled once; order of SKIP_RULES is kept so the first matching rule wins
+_COMPILED_RULES = [
+    (rule, _compile(rule.get("question_pattern")), _compile(rule.get("unless_pattern")))
+    for rule in SKIP_RULES
+]
+
+def rule_based_decision(q: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Full no-image analysis result if a rule decides `q`, else None (ask the model)"""
+    for rule, pattern, unless in _COMPILED_RULES:
+        if rule.get("min_grade") is not None and q['grade'] < rule["min_grade"]:
+            continue
+        if rule.get("sections") and q.get('section') not in rule["sections"]:
+            continue
+        if pattern is not None and not pattern.search(q['question_text'] or ""):
+            continue
+        if unless is not None and any(
+            unless.search(q.get(key) or "")
+            for key in ('question_text', 'option_a', 'option_b', 'option_c', 'option_d')
+        ):
+            continue
+        return {
+            "question_id": q['question_id'],
+            "grade": q['grade'],
+            "image_required": False,
+            "reason": f"Rule {rule['id']}: {rule['reason']}",
+            "question_image_prompt": None,
+            "option_a_image_prompt": None,
+            "option_b_image_prompt": None,
+            "option_c_image_prompt": None,
+            "option_d_image_prompt": None,
+        }
+    return None
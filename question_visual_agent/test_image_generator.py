@@ -1,7 +1,9 @@
 from image_generator import generate_image
+from logging_config import setup_queue_logging
 
 # Simple test
 if __name__ == "__main__":
+    setup_queue_logging()
     print("🧪 Testing Image Generator\n")
     
     # Test prompt